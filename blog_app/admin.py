@@ -1,11 +1,27 @@
+from django import forms
 from django.contrib import admin
 from .models import Category, Article, Comment
 # Register your models here.
 
 
+class ArticleAdminForm(forms.ModelForm):
+    body_source = forms.CharField(widget=forms.Textarea, label='Body')
+
+    class Meta:
+        model = Article
+        fields = ['title', 'slug', 'category', 'body_format', 'body_source']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk and not self.instance.body_source:
+            # articles written before sources were kept are edited as HTML
+            self.initial['body_source'] = self.instance.article_body
+
+
 class ArticleAdmin(admin.ModelAdmin):
+    form = ArticleAdminForm
     prepopulated_fields = {"slug": ("title",)}
 
 admin.site.register(Category)
 admin.site.register(Article, ArticleAdmin)
-admin.site.register(Comment)
\ No newline at end of file
+admin.site.register(Comment)
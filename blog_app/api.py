@@ -0,0 +1,207 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.urlresolvers import reverse
+from django.db.models import QuerySet
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views import View
+
+from .models import Article, Category
+from .pagination import CursorPage
+from .views import (HomepageView, CategoryView, SearchByYearView, SearchByMonthView,
+                    SearchByDayView, ArticleView)
+
+# field name -> (columns it needs, value)
+ARTICLE_FIELDS = {
+    'id': (['article_id'], lambda article, request: article.article_id),
+    'title': (['title'], lambda article, request: article.title),
+    'slug': (['slug'], lambda article, request: article.slug),
+    'url': (['article_id', 'slug'],
+            lambda article, request: request.build_absolute_uri(article.get_absolute_url())),
+    'created': (['created'], lambda article, request: article.created),
+    'last_modified': (['last_modified'], lambda article, request: article.last_modified),
+    'excerpt': (['excerpt'], lambda article, request: article.excerpt),
+    'word_count': (['word_count'], lambda article, request: article.word_count),
+    'comment_count': (['comment_count'], lambda article, request: article.comment_count),
+    'last_comment': (['last_comment'], lambda article, request: article.last_comment),
+    'categories': ([], lambda article, request: [category.name for category in article.category.all()]),
+}
+DETAIL_FIELDS = dict(ARTICLE_FIELDS, body=(['article_body'], lambda article, request: article.article_body))
+# cursors are built from these, so they are always loaded
+ORDERING_COLUMNS = ['article_id', 'created', 'last_modified']
+EXPORT_BATCH_SIZE = 1000
+
+
+def parse_fields(value, allowed):
+    """
+    Turn the `fields` parameter into a list of field names, all fields
+    when it is missing.
+    """
+    if not value:
+        return list(allowed)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = sorted(set(fields) - set(allowed))
+    if unknown:
+        raise ValueError('Unknown fields: {}'.format(', '.join(unknown)))
+    return fields
+
+
+def article_queryset(fields, allowed=ARTICLE_FIELDS):
+    # only the columns of the requested fields, categories only when asked
+    columns = set(ORDERING_COLUMNS)
+    for name in fields:
+        columns.update(allowed[name][0])
+    articles = Article.objects.only(*columns)
+    if 'categories' in fields:
+        articles = articles.prefetch_related('category')
+    return articles
+
+
+def serialize_article(article, fields, request, allowed=ARTICLE_FIELDS):
+    return {name: allowed[name][1](article, request) for name in fields}
+
+
+def page_links(request, page):
+    links = {}
+    for name, param, cursor in (('next', 'after', page.next_cursor),
+                                ('previous', 'before', page.previous_cursor)):
+        links[name] = None
+        if cursor is not None:
+            query = request.GET.copy()
+            query.pop('after', None)
+            query.pop('before', None)
+            query[param] = cursor
+            links[name] = request.build_absolute_uri('?' + query.urlencode())
+    return links
+
+
+class ApiMixin:
+    """
+    Parse the sparse fieldset and answer errors as JSON. Put it in front of
+    the HTML view whose querysets and caching the API reuses.
+    """
+    allowed_fields = ARTICLE_FIELDS
+    # links and article URLs are absolute
+    cache_per_host = True
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            self.fields = parse_fields(request.GET.get('fields'), self.allowed_fields)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except Http404:
+            return JsonResponse({'error': 'Not found'}, status=404)
+
+
+class ApiListMixin(ApiMixin):
+    per_page = 20
+    cache_page_params = ('after', 'before', 'fields')
+
+    def get_articles(self):
+        return article_queryset(self.fields)
+
+    def render_to_response(self, context, **response_kwargs):
+        if 'articles' not in context:
+            # e.g. an unknown category
+            raise Http404
+        page = context['articles']
+        data = {'results': [serialize_article(article, self.fields, self.request)
+                            for article in page]}
+        data.update(page_links(self.request, page))
+        return JsonResponse(data)
+
+
+class ApiHomepageView(ApiListMixin, HomepageView):
+    pass
+
+
+class ApiCategoryView(ApiListMixin, CategoryView):
+    pass
+
+
+class ApiDateMixin(ApiListMixin):
+
+    def get_page_context(self, objects, page, count=None):
+        # cursors instead of page numbers, in the order of the date index
+        if not isinstance(objects, QuerySet):
+            return CursorPage([], None)
+        return self.get_cursor_page_context(objects, ordering=('-last_modified', '-article_id'))
+
+
+class ApiYearView(ApiDateMixin, SearchByYearView):
+    pass
+
+
+class ApiMonthView(ApiDateMixin, SearchByMonthView):
+    pass
+
+
+class ApiDayView(ApiDateMixin, SearchByDayView):
+    pass
+
+
+class ApiArticleView(ApiMixin, ArticleView):
+    allowed_fields = DETAIL_FIELDS
+    cache_page_params = ('after', 'before', 'order', 'fields')
+
+    def get_article(self, article_id):
+        article = (article_queryset(self.fields, DETAIL_FIELDS)
+                   .filter(article_id=article_id).first())
+        if article is None:
+            raise Http404
+        return article
+
+    def get(self, request, *args, **kwargs):
+        article = self.get_article(kwargs['article_id'])
+        comments = self.get_article_comments(article.pk)
+        data = serialize_article(article, self.fields, request, DETAIL_FIELDS)
+        data['comments'] = {'order': self.get_comments_order(),
+                            'results': [{'id': comment.pk,
+                                         'author': comment.author.username,
+                                         'date': comment.date,
+                                         'body': comment.body} for comment in comments]}
+        data['comments'].update(page_links(request, comments))
+        return JsonResponse(data)
+
+
+class ApiCategoryListView(View):
+
+    def get(self, request, *args, **kwargs):
+        categories = Category.objects.order_by('name').values_list('name', flat=True)
+        return JsonResponse({'results': [
+            {'name': name,
+             'url': request.build_absolute_uri(reverse('category', args=[name])),
+             'api_url': request.build_absolute_uri(reverse('api_category', args=[name]))}
+            for name in categories]})
+
+
+class ApiExportView(ApiMixin, View):
+    """
+    All articles as JSON lines, streamed while they are read in primary key
+    order, batch by batch.
+    """
+    allowed_fields = DETAIL_FIELDS
+
+    def iterate_articles(self):
+        articles = article_queryset(self.fields, DETAIL_FIELDS).order_by('pk')
+        if 'categories' not in self.fields:
+            yield from articles.iterator()
+            return
+        # prefetching does not work with iterator(), so batches are walked by
+        # primary key and prefetched one at a time
+        last_pk = None
+        while True:
+            batch = articles if last_pk is None else articles.filter(pk__gt=last_pk)
+            batch = list(batch[:EXPORT_BATCH_SIZE])
+            if not batch:
+                return
+            yield from batch
+            last_pk = batch[-1].pk
+
+    def get(self, request, *args, **kwargs):
+        lines = (json.dumps(serialize_article(article, self.fields, request, DETAIL_FIELDS),
+                            cls=DjangoJSONEncoder) + '\n'
+                 for article in self.iterate_articles())
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
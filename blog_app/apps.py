@@ -1,5 +1,20 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def create_search_index(using, **kwargs):
+    from django.db import connections
+    from .search import create_search_index
+    create_search_index(connections[using])
 
 
 class BlogAppConfig(AppConfig):
     name = 'blog_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # the search index is an FTS5 virtual table, which models can't describe
+        post_migrate.connect(create_search_index, sender=self)
+        from .sqlite import apply_pragmas
+        connection_created.connect(apply_pragmas, dispatch_uid='blog_app.sqlite.apply_pragmas')
@@ -0,0 +1,58 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+
+# users kept per process, the least recently used ones go first
+MAX_USERS = 1000
+
+_users = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_user_cache_timeout():
+    return getattr(settings, 'BLOG_USER_CACHE_TIMEOUT', 60)
+
+
+def forget_user(user_id=None):
+    """
+    Drop one user from the cache of this process, every user without an id.
+    """
+    with _lock:
+        if user_id is None:
+            _users.clear()
+        else:
+            _users.pop(user_id, None)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend keeping the users of authenticated requests, with their
+    permissions once they are checked, in memory for
+    BLOG_USER_CACHE_TIMEOUT seconds, at most MAX_USERS of them. Signals drop a user when it, its
+    groups or its permissions change; other processes see the change when
+    their copy expires.
+    """
+
+    def get_user(self, user_id):
+        now = time.monotonic()
+        with _lock:
+            user, expires = _users.get(user_id, (None, 0))
+            if user is not None:
+                _users.move_to_end(user_id)
+        if user is None or expires < now:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            # loads the permissions too, so has_perm() doesn't query
+            self.get_all_permissions(user)
+            with _lock:
+                _users.pop(user_id, None)
+                _users[user_id] = (user, now + get_user_cache_timeout())
+                if len(_users) > MAX_USERS:
+                    _users.popitem(last=False)
+        # every request gets its own copy to modify
+        return copy.copy(user)
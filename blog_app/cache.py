@@ -0,0 +1,254 @@
+import re
+import time
+from calendar import timegm
+from collections import Counter
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+CSRF_MARKER = '__blog_app_csrf_token__'
+CSRF_VALUE = re.compile(r'''(name=['"]csrfmiddlewaretoken['"] value=['"])[^'"]*''')
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified')
+# the parts of a page that depend on the visitor
+USER_WIDGETS = {
+    'login': 'blog_app/includes/login_widget.html',
+    'comment_form': 'blog_app/includes/comment_form.html',
+}
+
+
+def page_cache_enabled():
+    return getattr(settings, 'BLOG_PAGE_CACHE', False)
+
+
+def get_page_cache():
+    return caches[getattr(settings, 'BLOG_PAGE_CACHE_ALIAS', 'default')]
+
+
+def fragment_cache_enabled():
+    return getattr(settings, 'BLOG_FRAGMENT_CACHE', False)
+
+
+def get_fragment_cache():
+    return caches[getattr(settings, 'BLOG_FRAGMENT_CACHE_ALIAS', 'default')]
+
+
+def deferred_widgets_enabled():
+    return getattr(settings, 'BLOG_DEFERRED_WIDGETS', False)
+
+
+def _hash(value):
+    return md5(value.encode('utf-8')).hexdigest()
+
+
+def _group_key(group):
+    return 'blog_app.group.{}'.format(_hash(group))
+
+
+def get_group_version(group, cache=None):
+    if cache is None:
+        cache = get_page_cache()
+    key = _group_key(group)
+    version = cache.get(key)
+    if version is None:
+        # the time of the change leads, it is the Last-Modified of the group
+        version = '{}.{}'.format(int(time.time()), uuid4().hex)
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def group_version_time(version):
+    try:
+        return int(version.split('.', 1)[0])
+    except ValueError:
+        return None
+
+
+def invalidate_groups(groups):
+    """
+    Drop the version of every group, which orphans every cached page of
+    these groups at once and changes their HTTP validators. Works with any
+    cache backend, no key scanning.
+    """
+    get_page_cache().delete_many([_group_key(group) for group in set(groups)])
+
+
+def article_group(article_id):
+    return 'article:{}'.format(article_id)
+
+
+def category_group(name):
+    return 'category:{}'.format(name)
+
+
+def archive_group(year, month=None, day=None):
+    return 'date:' + '/'.join(part for part in (year, month, day) if part is not None)
+
+
+def date_groups(date):
+    if timezone.is_aware(date):
+        date = timezone.localtime(date)
+    year, month, day = '{:%Y %m %d}'.format(date).split()
+    return [archive_group(year), archive_group(year, month), archive_group(year, month, day)]
+
+
+HOMEPAGE_GROUP = 'homepage'
+# every article fragment renders category badges, so any category change
+# invalidates all of them
+CATEGORIES_GROUP = 'categories'
+
+fragment_cache_stats = Counter()
+
+
+def get_fragment_cache_stats():
+    return {'hits': fragment_cache_stats['hits'],
+            'misses': fragment_cache_stats['misses']}
+
+
+def get_categories_version():
+    return get_group_version(CATEGORIES_GROUP, get_fragment_cache())
+
+
+def invalidate_category_fragments():
+    if fragment_cache_enabled():
+        get_fragment_cache().delete(_group_key(CATEGORIES_GROUP))
+
+
+def fragment_cache_key(fragment_name, article, categories_version):
+    state = '{}:{}'.format(article.last_modified.isoformat(), getattr(article, 'comment_count', 0))
+    return 'blog_app.fragment.{}.{}.{}.{}'.format(
+        fragment_name, article.pk, _hash(state), categories_version)
+
+
+def feed_cache_key(group, host, feed_type):
+    # item links are absolute, so the feed depends on the host
+    return 'blog_app.feed.{}.{}.{}.{}'.format(_hash(group), get_group_version(group),
+                                              _hash(host), feed_type)
+
+
+class CachedPageMixin:
+    """
+    Serve anonymous GET requests from the page cache when BLOG_PAGE_CACHE is
+    enabled. Every page belongs to a single invalidation group returned by
+    get_cache_group(); signals drop the group when its content changes.
+    """
+    cache_page_params = ('page', 'after', 'before')
+    # pages with absolute URLs are cached per host and scheme
+    cache_per_host = False
+
+    def get_cache_group(self):
+        raise NotImplementedError('Cached views must define their cache group')
+
+    def get_page_cache_key(self, request):
+        group = self.get_cache_group()
+        params = '&'.join('{}={}'.format(name, request.GET.get(name, ''))
+                          for name in self.cache_page_params)
+        page = '{}?{}'.format(request.path, params)
+        if self.cache_per_host:
+            page = '{}://{}{}'.format(request.scheme, request.get_host(), page)
+        page = _hash(page)
+        return 'blog_app.page.{}.{}.{}'.format(_hash(group), get_group_version(group), page)
+
+    def dispatch(self, request, *args, **kwargs):
+        response = self.get_page_response(request, *args, **kwargs)
+        max_age = getattr(settings, 'BLOG_PUBLIC_MAX_AGE', 0)
+        if (deferred_widgets_enabled() and max_age and request.method in ('GET', 'HEAD')
+                and response.status_code in (200, 304)):
+            # the page is the same for every visitor, shared caches may keep it
+            patch_cache_control(response, public=True, max_age=max_age)
+        return response
+
+    def get_page_response(self, request, *args, **kwargs):
+        # with deferred widgets pages don't depend on the user, and looking
+        # the user up would read the session and add Vary: Cookie
+        if (not page_cache_enabled() or request.method != 'GET'
+                or (not deferred_widgets_enabled() and request.user.is_authenticated)):
+            return super().dispatch(request, *args, **kwargs)
+
+        cache = get_page_cache()
+        key = self.get_page_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content = cached['content']
+            if CSRF_MARKER in content:
+                content = content.replace(CSRF_MARKER, get_token(request))
+            response = HttpResponse(content, content_type=cached['content_type'])
+            for header, value in cached['headers'].items():
+                response[header] = value
+            # cached validators are as fresh as the page itself
+            return get_conditional_response(
+                request,
+                etag=cached['headers'].get('ETag'),
+                last_modified=parse_http_date_safe(cached['headers'].get('Last-Modified', '')),
+                response=response)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            # the CSRF token is per visitor, it is filled in on every hit
+            content = CSRF_VALUE.sub(r'\g<1>' + CSRF_MARKER, response.content.decode(response.charset))
+            headers = {header: response[header] for header in VALIDATOR_HEADERS
+                       if response.has_header(header)}
+            cache.set(key, {'content': content,
+                            'content_type': response['Content-Type'],
+                            'headers': headers},
+                      getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 600))
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Emit ETag and Last-Modified validators and answer revalidation requests
+    with 304 Not Modified before the page is rendered. The validators
+    follow the versions of the page's cache groups, which the signals bump
+    on every change that drops a cached page, whether or not the page cache
+    is enabled. get_validators() adds the newest timestamp of the page
+    content and the number of objects on it, read cheaply, for caches not
+    shared between processes.
+    """
+
+    def get_validator_groups(self):
+        return [self.get_cache_group()]
+
+    def get_validators(self):
+        raise NotImplementedError('Conditional views must define their validators')
+
+    def get_etag(self, request, versions, last_modified, count):
+        # the login section differs per user, so does the ETag, unless it
+        # is loaded separately
+        user = 'anonymous'
+        if not deferred_widgets_enabled() and request.user.is_authenticated:
+            user = request.user.pk
+        timestamp = last_modified.isoformat() if last_modified else ''
+        return quote_etag(_hash('{}:{}:{}:{}'.format(','.join(versions), timestamp, count, user)))
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+
+        versions = [get_group_version(group) for group in self.get_validator_groups()]
+        last_modified, count = self.get_validators()
+        etag = self.get_etag(request, versions, last_modified, count)
+        # a deletion moves the version time forward even though the newest
+        # remaining content is older
+        timestamps = [group_version_time(version) for version in versions]
+        if last_modified:
+            timestamps.append(timegm(last_modified.utctimetuple()))
+        timestamp = max(filter(None, timestamps), default=None)
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        if timestamp and not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(timestamp)
+        if not response.has_header('ETag'):
+            response['ETag'] = etag
+        return response
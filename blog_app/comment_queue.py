@@ -0,0 +1,233 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .models import Article, Comment, User
+from .signals import invalidate_commented_articles
+from .sqlite import retry_on_lock
+
+logger = logging.getLogger('blog_app.comments')
+_STOP = object()
+
+
+def comment_queue_enabled():
+    return getattr(settings, 'BLOG_COMMENT_QUEUE', False)
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class CommentQueue:
+    """
+    Write-behind buffer of validated comments. Requests only enqueue them,
+    a background thread inserts them with one bulk_create per batch of at
+    most `batch_size` comments or `interval` seconds, whichever is first.
+
+    With a spool file every comment is also appended to it before the
+    request returns, and dropped from it once its batch is committed; the
+    comments left in the file are queued again when the next queue starts.
+    Every process spools to its own file, `spool` suffixed with its pid; a
+    starting queue also takes over the files of processes that are gone.
+    A crash between the commit and the rewrite of the spool can write a
+    batch twice, it is never lost. Comments that can't be stored (deleted
+    article or author, a row the database rejects) are dropped alone.
+    """
+
+    def __init__(self, batch_size=100, interval=0.05, spool=None):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spool_base = spool
+        self.spool = '{}.{}'.format(spool, os.getpid()) if spool else None
+        self._queue = queue.Queue()
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        for entry in self._read_spool():
+            self._pending[entry['id']] = entry
+        if self.spool:
+            # under a lock, so that two starting processes don't both replay a file
+            with open(self.spool_base + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                orphans = list(self._orphaned_spools())
+                for path in orphans:
+                    for entry in self._read_spool(path):
+                        self._pending[entry['id']] = entry
+                self._rewrite_spool()
+                for path in orphans:
+                    os.remove(path)
+        for entry in self._pending.values():
+            self._queue.put(entry)
+        self._thread = threading.Thread(target=self._run, name='blog-comment-queue', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write everything still queued and end the worker.
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def put(self, author, article, body):
+        entry = {'id': uuid.uuid4().hex, 'author_id': author.pk,
+                 'article_id': article.pk, 'body': body}
+        with self._lock:
+            self._pending[entry['id']] = entry
+            if self.spool:
+                with open(self.spool, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+        self._queue.put(entry)
+
+    def join(self):
+        """
+        Block until every comment queued so far is written.
+        """
+        self._queue.join()
+
+    def _read_spool(self, path=None):
+        path = path or self.spool
+        if not path or not os.path.exists(path):
+            return []
+        with open(path) as f:
+            # a line cut short by a crash was never acknowledged
+            entries = []
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    pass
+            return entries
+
+    def _orphaned_spools(self):
+        # spool files of processes that are gone
+        for path in glob.glob(glob.escape(self.spool_base) + '.*'):
+            pid = path[len(self.spool_base) + 1:]
+            if pid.isdigit() and int(pid) != os.getpid() and not process_exists(int(pid)):
+                yield path
+
+    def _rewrite_spool(self):
+        temporary = self.spool + '.tmp'
+        with open(temporary, 'w') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in self._pending.values())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.spool)
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.interval
+        while batch[-1] is not _STOP and len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            stopping = False
+            while not stopping:
+                batch = self._take_batch()
+                stopping = batch[-1] is _STOP
+                entries = [entry for entry in batch if entry is not _STOP]
+                try:
+                    if entries:
+                        self.write(entries)
+                except Exception:
+                    # they stay in the spool, if there is one
+                    logger.exception('Could not write %d queued comments', len(entries))
+                finally:
+                    for i in batch:
+                        self._queue.task_done()
+        finally:
+            connection.close()
+
+    def write(self, entries):
+        article_ids = {entry['article_id'] for entry in entries}
+        author_ids = {entry['author_id'] for entry in entries}
+        # articles and authors deleted while their comments were waiting
+        existing = set(Article.objects.filter(pk__in=article_ids).values_list('pk', flat=True))
+        authors = set(User.objects.filter(pk__in=author_ids).values_list('pk', flat=True))
+        comments = [Comment(author_id=entry['author_id'],
+                            article_commented_id=entry['article_id'],
+                            body=entry['body'])
+                    for entry in entries
+                    if entry['article_id'] in existing and entry['author_id'] in authors]
+
+        if comments:
+            try:
+                retry_on_lock(lambda: self.insert(comments))
+            except IntegrityError:
+                # one bad row must not take the rest of the batch with it
+                for comment in comments:
+                    try:
+                        retry_on_lock(lambda: self.insert([comment]))
+                    except IntegrityError:
+                        logger.exception('Dropped a queued comment of article %s',
+                                         comment.article_commented_id)
+        with self._lock:
+            for entry in entries:
+                self._pending.pop(entry['id'], None)
+            if self.spool:
+                self._rewrite_spool()
+        invalidate_commented_articles(existing)
+
+    def insert(self, comments):
+        # a savepoint of its own, so a failed insert can be retried row by row
+        with transaction.atomic():
+            created = Comment.objects.bulk_create(comments)
+            # bulk_create sends no signals, so the counters are kept here
+            counts = {}
+            for comment in created:
+                count, newest = counts.get(comment.article_commented_id, (0, comment.date))
+                counts[comment.article_commented_id] = (count + 1, max(newest, comment.date))
+            for article_id, (count, newest) in counts.items():
+                Article.objects.filter(pk=article_id).update(
+                    comment_count=F('comment_count') + count, last_comment=newest)
+
+
+_comment_queue = None
+_comment_queue_lock = threading.Lock()
+
+
+def get_comment_queue():
+    """
+    The queue of this process, started on first use.
+    """
+    global _comment_queue
+    with _comment_queue_lock:
+        if _comment_queue is None:
+            _comment_queue = CommentQueue(
+                batch_size=getattr(settings, 'BLOG_COMMENT_QUEUE_BATCH', 100),
+                interval=getattr(settings, 'BLOG_COMMENT_QUEUE_INTERVAL', 0.05),
+                spool=getattr(settings, 'BLOG_COMMENT_QUEUE_SPOOL', None))
+            _comment_queue.start()
+            atexit.register(_comment_queue.stop)
+        return _comment_queue
@@ -0,0 +1,129 @@
+import io
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from .cache import page_cache_enabled, get_page_cache, feed_cache_key
+
+
+class StreamingFeedMixin:
+    """
+    Write a feed chunk by chunk: the opening of the document, every item as
+    soon as it is built and the closing tags, instead of collecting all
+    items and the whole document in memory first.
+    """
+    item_element = None
+
+    def __init__(self, *args, updated=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.updated = updated
+
+    def latest_post_date(self):
+        # items are not kept on the feed, the caller knows the newest change
+        return self.updated or super().latest_post_date()
+
+    def build_item(self, **kwargs):
+        # reuse the normalization of add_item without keeping the item
+        self.add_item(**kwargs)
+        return self.items.pop()
+
+    def start_root(self, handler):
+        raise NotImplementedError
+
+    def end_root(self, handler):
+        raise NotImplementedError
+
+    def stream(self, items, encoding='utf-8'):
+        buffer = io.StringIO()
+        handler = SimplerXMLGenerator(buffer, encoding)
+
+        def flush():
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        handler.startDocument()
+        self.start_root(handler)
+        yield flush()
+        for item in items:
+            handler.startElement(self.item_element, self.item_attributes(item))
+            self.add_item_elements(handler, item)
+            handler.endElement(self.item_element)
+            yield flush()
+        self.end_root(handler)
+        yield flush()
+
+
+class StreamingRssFeed(StreamingFeedMixin, Rss201rev2Feed):
+    item_element = 'item'
+
+    def start_root(self, handler):
+        handler.startElement('rss', self.rss_attributes())
+        handler.startElement('channel', self.root_attributes())
+        self.add_root_elements(handler)
+
+    def end_root(self, handler):
+        self.endChannelElement(handler)
+        handler.endElement('rss')
+
+
+class StreamingAtomFeed(StreamingFeedMixin, Atom1Feed):
+    item_element = 'entry'
+
+    def start_root(self, handler):
+        handler.startElement('feed', self.root_attributes())
+        self.add_root_elements(handler)
+
+    def end_root(self, handler):
+        handler.endElement('feed')
+
+
+FEED_CLASSES = {'rss': StreamingRssFeed, 'atom': StreamingAtomFeed}
+
+
+def article_items(feed, request, articles):
+    for article in articles:
+        link = request.build_absolute_uri(article.get_absolute_url())
+        yield feed.build_item(title=article.title,
+                              link=link,
+                              unique_id=link,
+                              description=article.excerpt,
+                              pubdate=article.created,
+                              updateddate=article.last_modified,
+                              categories=[category.name for category in article.category.all()])
+
+
+def _store_when_complete(chunks, cache, key, content_type):
+    content = []
+    for chunk in chunks:
+        content.append(chunk)
+        yield chunk
+    cache.set(key, {'content': ''.join(content), 'content_type': content_type},
+              getattr(settings, 'BLOG_FEED_CACHE_TIMEOUT', 3600))
+
+
+def feed_response(request, feed_type, group, title, link, articles, updated):
+    """
+    Stream the feed of `articles`. With the page cache enabled the finished
+    document is stored under the cache group and served from there until
+    the group is invalidated.
+    """
+    cache = get_page_cache() if page_cache_enabled() else None
+    if cache is not None:
+        key = feed_cache_key(group, request.get_host(), feed_type)
+        cached = cache.get(key)
+        if cached is not None:
+            return HttpResponse(cached['content'], content_type=cached['content_type'])
+
+    feed = FEED_CLASSES[feed_type](title=title,
+                                   link=request.build_absolute_uri(link),
+                                   description=title,
+                                   feed_url=request.build_absolute_uri(),
+                                   updated=updated)
+    chunks = feed.stream(article_items(feed, request, articles))
+    if cache is not None:
+        chunks = _store_when_complete(chunks, cache, key, feed.content_type)
+    return StreamingHttpResponse(chunks, content_type=feed.content_type)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog_app.cache import (invalidate_groups, invalidate_category_fragments, category_group,
+                            HOMEPAGE_GROUP)
+from blog_app.models import Article, Category, make_excerpt
+from blog_app.signals import article_listing_groups
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored excerpts and word counts of all articles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def invalidate(self, changed):
+        groups = [HOMEPAGE_GROUP]
+        for article in changed:
+            groups.extend(article_listing_groups(article.pk, article.last_modified))
+        names = (Category.objects.filter(article__in=[article.pk for article in changed])
+                                 .values_list('name', flat=True).distinct())
+        groups.extend(category_group(name) for name in names)
+        invalidate_groups(groups)
+        # article cards are keyed on last_modified, which did not move
+        invalidate_category_fragments()
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        articles = (Article.objects.only('article_id', 'article_body', 'excerpt', 'word_count',
+                                         'last_modified')
+                                   .order_by('pk'))
+        updated = 0
+        last_pk = None
+        while True:
+            batch = articles if last_pk is None else articles.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            changed = []
+            with transaction.atomic():
+                for article in batch:
+                    excerpt, word_count = make_excerpt(article.article_body)
+                    if (excerpt, word_count) == (article.excerpt, article.word_count):
+                        continue
+                    # update() leaves last_modified untouched, unlike save()
+                    Article.objects.filter(pk=article.pk).update(excerpt=excerpt,
+                                                                 word_count=word_count)
+                    changed.append(article)
+            if changed:
+                self.invalidate(changed)
+            updated += len(changed)
+            last_pk = batch[-1].pk
+        self.stdout.write('Updated {} articles'.format(updated))
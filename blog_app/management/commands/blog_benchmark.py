@@ -0,0 +1,256 @@
+import io
+import json
+import math
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+from statistics import mean
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from blog_app.models import Article, Category, Comment, User, make_excerpt
+from blog_app.sitemaps import SECTIONS
+from blog_app.urls import urlpatterns
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+         'incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud '
+         'exercitation ullamco laboris nisi aliquip ex ea commodo consequat').split()
+
+
+# URL groups get_routes fills in
+URL_ARGUMENTS = {'year', 'month', 'day', 'article_id', 'slug', 'category_name',
+                 'feed_type', 'section', 'page'}
+# logout would end the session of --authenticated runs, metrics is staff only
+SKIPPED_ROUTES = {'logout', 'metrics'}
+
+
+def percentile(values, percent):
+    # nearest-rank percentile
+    ordered = sorted(values)
+    rank = max(int(math.ceil(percent / 100 * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+def fetch(client, url):
+    response = client.get(url)
+    if response.streaming:
+        # streamed responses are only built while they are read
+        b''.join(response.streaming_content)
+    return response
+
+
+class Seeder:
+    """
+    Fills the database with a reproducible corpus: the same seed and sizes
+    always produce the same titles, bodies, dates and relations.
+    """
+
+    def __init__(self, seed, articles, categories, users, comments, days):
+        self.random = random.Random(seed)
+        self.sizes = {'articles': articles, 'categories': categories,
+                      'users': users, 'comments': comments}
+        self.days = days
+
+    def text(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words))
+
+    def seed(self, batch_size=1000):
+        categories = [Category.objects.create(name='category-{}'.format(i))
+                      for i in range(self.sizes['categories'])]
+        # hashing one password is enough, users are only logged in by the client
+        password = make_password('benchmark')
+        User.objects.bulk_create(User(username='reader{}'.format(i), password=password)
+                                 for i in range(self.sizes['users']))
+        users = list(User.objects.filter(username__startswith='reader').values_list('pk', flat=True))
+
+        now = timezone.now()
+        by_day = {}
+        article_ids = []
+        for start in range(0, self.sizes['articles'], batch_size):
+            articles, links = [], []
+            for i in range(start, min(start + batch_size, self.sizes['articles'])):
+                article_id = '{:06x}'.format(i)
+                body = ''.join('<p>{}</p>'.format(self.text(self.random.randint(40, 120)))
+                               for _ in range(self.random.randint(2, 8)))
+                excerpt, word_count = make_excerpt(body)
+                title = self.text(self.random.randint(2, 8)).capitalize()
+                articles.append(Article(article_id=article_id, title=title,
+                                        slug='-'.join(title.lower().split()),
+                                        article_body=body, excerpt=excerpt,
+                                        word_count=word_count))
+                for category in self.random.sample(categories, min(len(categories),
+                                                                   self.random.randint(1, 3))):
+                    links.append(Article.category.through(article_id=article_id,
+                                                          category_id=category.pk))
+                by_day.setdefault(self.random.randrange(self.days), []).append(article_id)
+                article_ids.append(article_id)
+            with transaction.atomic():
+                Article.objects.bulk_create(articles)
+                Article.category.through.objects.bulk_create(links)
+
+        # spread the articles over the last days, auto_now ignores given values
+        for day, ids in by_day.items():
+            timestamp = now - timedelta(days=day)
+            Article.objects.filter(pk__in=ids).update(created=timestamp, last_modified=timestamp)
+
+        for start in range(0, self.sizes['comments'], batch_size):
+            count = min(batch_size, self.sizes['comments'] - start)
+            Comment.objects.bulk_create(
+                Comment(author_id=self.random.choice(users),
+                        article_commented_id=self.random.choice(article_ids),
+                        body=self.text(self.random.randint(5, 40)))
+                for _ in range(count))
+
+        call_command('rebuild_archive', stdout=io.StringIO())
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        call_command('reconcile_comment_counts', stdout=io.StringIO())
+        return categories, article_ids, sorted(by_day)
+
+
+class Command(BaseCommand):
+    help = ('Seed a reproducible corpus into a throwaway test database and measure '
+            'latency, queries and memory of every blog route')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=365,
+                            help='articles are spread over this many past days')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--requests', type=int, default=50,
+                            help='measured requests per route')
+        parser.add_argument('--authenticated', action='store_true',
+                            help='send requests as a logged in user')
+        parser.add_argument('--output', help='write the results as JSON to this file')
+        parser.add_argument('--in-place', action='store_true',
+                            help='seed the configured database in a transaction that is '
+                                 'rolled back afterwards, instead of a test database')
+
+    def get_routes(self, rng, categories, article_ids, days):
+        """
+        A URL maker for every named pattern of blog_app.urls, so that new
+        routes are measured without being listed here.
+        """
+        now = timezone.localtime(timezone.now())
+        dates = [now - timedelta(days=day) for day in days]
+        articles = list(Article.objects.filter(pk__in=rng.sample(article_ids, min(len(article_ids), 100)))
+                        .values_list('article_id', 'slug'))
+        sections = sorted(SECTIONS)
+
+        def url_maker(pattern):
+            groups = list(pattern.regex.groupindex)
+            missing = set(groups) - URL_ARGUMENTS
+            if missing:
+                raise CommandError('No benchmark arguments for {} of the URL {!r}'.format(
+                    ', '.join(sorted(missing)), pattern.name))
+
+            def make_url():
+                date = rng.choice(dates)
+                article_id, slug = rng.choice(articles)
+                values = {'year': '{:%Y}'.format(date), 'month': '{:%m}'.format(date),
+                          'day': '{:%d}'.format(date), 'article_id': article_id, 'slug': slug,
+                          'category_name': rng.choice(categories).name,
+                          'feed_type': rng.choice(('rss', 'atom')),
+                          'section': rng.choice(sections), 'page': 1}
+                url = reverse(pattern.name, kwargs={group: values[group] for group in groups})
+                if pattern.name == 'search':
+                    url += '?q=' + rng.choice(WORDS)
+                return url
+            return make_url
+
+        return {pattern.name: url_maker(pattern) for pattern in urlpatterns
+                if pattern.name and pattern.name not in SKIPPED_ROUTES}
+
+    def measure(self, client, make_url, requests):
+        latencies, queries = [], []
+        for _ in range(requests):
+            url = make_url()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = fetch(client, url)
+                latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise CommandError('{} answered {}'.format(url, response.status_code))
+            queries.append(len(context.captured_queries))
+
+        # memory is traced in a separate pass, tracing slows requests down
+        tracemalloc.start()
+        for _ in range(min(requests, 5)):
+            fetch(client, make_url())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return {'requests': requests,
+                'p50_ms': round(percentile(latencies, 50), 3),
+                'p95_ms': round(percentile(latencies, 95), 3),
+                'p99_ms': round(percentile(latencies, 99), 3),
+                'mean_ms': round(mean(latencies), 3),
+                'queries_mean': round(mean(queries), 2),
+                'queries_max': max(queries),
+                'peak_memory_kb': round(peak / 1024, 1)}
+
+    def run(self, options):
+        seeder = Seeder(options['seed'], options['articles'], options['categories'],
+                        options['users'], options['comments'], options['days'])
+        started = time.perf_counter()
+        categories, article_ids, days = seeder.seed()
+        seed_seconds = time.perf_counter() - started
+        if not categories or not article_ids:
+            raise CommandError('The corpus needs at least one article and one category')
+
+        client = Client()
+        if options['authenticated']:
+            client.force_login(User.objects.filter(username__startswith='reader').first())
+
+        rng = random.Random(options['seed'])
+        results = {}
+        with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+            for name, make_url in sorted(self.get_routes(rng, categories, article_ids, days).items()):
+                # warm up template loading and connection setup
+                fetch(client, make_url())
+                results[name] = self.measure(client, make_url, options['requests'])
+
+        return {'seed': options['seed'],
+                'authenticated': options['authenticated'],
+                'corpus': dict(seeder.sizes, days=options['days'],
+                               seed_seconds=round(seed_seconds, 2)),
+                'routes': results}
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('The corpus needs at least one user')
+        # the seeded pages, group versions and metrics stay out of the live caches
+        benchmark_caches = {alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                    'LOCATION': 'blog-benchmark-{}'.format(alias)}
+                            for alias in settings.CACHES}
+        with override_settings(CACHES=benchmark_caches):
+            if options['in_place']:
+                with transaction.atomic():
+                    report = self.run(options)
+                    transaction.set_rollback(True)
+            else:
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                try:
+                    report = self.run(options)
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        row = '{:<16} {:>9} {:>9} {:>9} {:>9} {:>12}'
+        self.stdout.write(row.format('route', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'peak KB'))
+        for name, result in report['routes'].items():
+            self.stdout.write(row.format(name, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                                         result['queries_max'], result['peak_memory_kb']))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from blog_app.metrics import get_metrics, reset_metrics
+
+
+class Command(BaseCommand):
+    help = 'Print the request timings collected by PerformanceMiddleware per URL name'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='print the metrics as JSON')
+        parser.add_argument('--reset', action='store_true', help='clear the metrics after printing')
+
+    def handle(self, *args, **options):
+        metrics = get_metrics()
+        if options['json']:
+            self.stdout.write(json.dumps(metrics, indent=2, sort_keys=True))
+        else:
+            row = '{:<20} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>12}'
+            self.stdout.write(row.format('url name', 'requests', 'mean ms', 'p50 ms', 'p95 ms',
+                                         'p99 ms', 'queries', 'template ms'))
+            for name, values in sorted(metrics.items()):
+                # percentiles are bucket bounds, '-' is beyond the last bucket
+                self.stdout.write(row.format(
+                    name, values['requests'], values['mean_ms'],
+                    *[values[p] or '-' for p in ('p50_ms', 'p95_ms', 'p99_ms')],
+                    values['sql_queries_mean'], values['template_ms_mean']))
+        if options['reset']:
+            reset_metrics()
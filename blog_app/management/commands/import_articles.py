@@ -0,0 +1,202 @@
+import csv
+import json
+import re
+import sys
+from collections import Counter
+from hashlib import sha1
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from blog_app.cache import invalidate_groups, category_group, date_groups, HOMEPAGE_GROUP
+from blog_app.models import Article, ArchiveDay, Category, make_excerpt, remove_not_safe, local_date
+from blog_app.search import index_new_articles
+
+ArticleCategory = Article.category.through
+ARTICLE_ID = re.compile(r'^[A-Za-z0-9]{6}$')
+# columns filled in from the record, the others get their defaults
+RECORD_FIELDS = ('article_id', 'title', 'slug', 'article_body', 'excerpt', 'word_count')
+
+
+def insert_sql(model, columns):
+    quote = connection.ops.quote_name
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table), ', '.join(quote(column) for column in columns),
+        ', '.join(['%s'] * len(columns)))
+
+
+def derived_ids(seed):
+    """
+    Ids derived from the article content, in the order they are tried, so
+    that the same article always gets the same id in the same database.
+    """
+    attempt = 0
+    while True:
+        yield sha1('{}:{}'.format(seed, attempt).encode('utf-8')).hexdigest()[:6]
+        attempt += 1
+
+
+def content_digest(title, body):
+    return sha1('{}\0{}'.format(title, body).encode('utf-8')).digest()
+
+
+def derive_article_id(seed, taken):
+    # the first free id
+    return next(article_id for article_id in derived_ids(seed) if article_id not in taken)
+
+
+def read_jsonl(stream):
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise CommandError('Line {}: {}'.format(line_number, e))
+
+
+def read_csv(stream):
+    for record in csv.DictReader(stream):
+        # categories are separated with semicolons inside a single column
+        record['categories'] = [name for name in (record.get('categories') or '').split(';')
+                                if name.strip()]
+        yield record
+
+
+class Command(BaseCommand):
+    help = 'Import articles from a JSON lines or CSV file in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="input file, '-' reads JSON lines from stdin")
+        parser.add_argument('--format', choices=['jsonl', 'csv'],
+                            help='input format, guessed from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def get_records(self, path, input_format):
+        if input_format is None:
+            input_format = 'csv' if path.endswith('.csv') else 'jsonl'
+        reader = read_csv if input_format == 'csv' else read_jsonl
+        if path == '-':
+            yield from reader(sys.stdin)
+        else:
+            with open(path, newline='', encoding='utf-8') as stream:
+                yield from reader(stream)
+
+    def get_category_ids(self, names):
+        ids = []
+        for name in names:
+            name = remove_not_safe(name.lower())
+            if not name:
+                continue
+            if name not in self.categories:
+                self.categories[name] = Category.objects.create(name=name).pk
+            ids.append(self.categories[name])
+        return ids
+
+    def is_same_article(self, article_id, title, body):
+        if article_id in self.new_articles:
+            return self.new_articles[article_id] == content_digest(title, body)
+        return Article.objects.filter(article_id=article_id, title=title, article_body=body).exists()
+
+    def build_article(self, record):
+        title = record.get('title') or ''
+        body = record.get('article_body') or record.get('body') or ''
+        if not title or not body:
+            return None, []
+
+        article_id = record.get('article_id')
+        if article_id:
+            if not ARTICLE_ID.match(article_id) or article_id in self.taken_ids:
+                # invalid or already imported
+                return None, []
+        else:
+            for article_id in derived_ids('{}\0{}'.format(title, body)):
+                if article_id not in self.taken_ids:
+                    break
+                if self.is_same_article(article_id, title, body):
+                    # imported before, by this or an earlier run
+                    return None, []
+        self.taken_ids.add(article_id)
+        self.new_articles[article_id] = content_digest(title, body)
+
+        excerpt, word_count = make_excerpt(body)
+        article = Article(article_id=article_id,
+                          title=title,
+                          slug=record.get('slug') or slugify(title),
+                          article_body=body,
+                          excerpt=excerpt,
+                          word_count=word_count)
+        return article, self.get_category_ids(record.get('categories') or [])
+
+    def insert_articles(self, cursor, articles):
+        # building the SQL of bulk_create takes several times longer than
+        # SQLite needs to run it, so rows are written with executemany; the
+        # columns not taken from the record are prepared once per batch, as
+        # bulk_create would (ImportArticlesCommandTest compares the rows)
+        now = timezone.now()
+        fields = Article._meta.concrete_fields
+        constants = {}
+        for field in fields:
+            if field.attname in RECORD_FIELDS or callable(field.default):
+                continue
+            value = now if field.attname in ('created', 'last_modified') else field.get_default()
+            constants[field.attname] = field.get_db_prep_save(value, connection)
+        rows = []
+        for article in articles:
+            article.created = article.last_modified = now
+            rows.append([constants[field.attname] if field.attname in constants
+                         else field.get_db_prep_save(field.pre_save(article, True), connection)
+                         for field in fields])
+        cursor.executemany(insert_sql(Article, [field.column for field in fields]), rows)
+
+    def save_batch(self, batch):
+        articles = [article for article, category_ids in batch]
+        links = [(article.pk, category_id)
+                 for article, category_ids in batch
+                 for category_id in set(category_ids)]
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.insert_articles(cursor, articles)
+            cursor.executemany(insert_sql(ArticleCategory, ['article_id', 'category_id']), links)
+            # no signals are sent, keep the derived data in sync here
+            days = Counter(local_date(article.last_modified) for article in articles)
+            for day, count in days.items():
+                ArchiveDay.objects.add_articles(day, count)
+            index_new_articles(articles)
+        self.touched_categories.update(category_id for article_id, category_id in links)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('Batch size must be positive')
+
+        self.categories = dict(Category.objects.values_list('name', 'pk'))
+        self.taken_ids = set(Article.objects.values_list('article_id', flat=True).iterator())
+        self.touched_categories = set()
+        # digests of the title and body of the articles of this run, to find
+        # repeated records without keeping their text
+        self.new_articles = {}
+
+        imported = skipped = 0
+        batch = []
+        for record in self.get_records(options['path'], options['format']):
+            article, category_ids = self.build_article(record)
+            if article is None:
+                skipped += 1
+                continue
+            batch.append((article, category_ids))
+            if len(batch) >= batch_size:
+                self.save_batch(batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            self.save_batch(batch)
+            imported += len(batch)
+
+        if imported:
+            names = Category.objects.filter(pk__in=self.touched_categories).values_list('name', flat=True)
+            invalidate_groups([HOMEPAGE_GROUP] + date_groups(timezone.now()) +
+                              [category_group(name) for name in names])
+        self.stdout.write('Imported {} articles, skipped {}'.format(imported, skipped))
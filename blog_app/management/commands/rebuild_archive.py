@@ -0,0 +1,19 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog_app.models import Article, ArchiveDay, local_date
+
+
+class Command(BaseCommand):
+    help = 'Recompute the number of articles per day used by the date archive pages'
+
+    def handle(self, *args, **options):
+        counts = Counter(local_date(last_modified) for last_modified in
+                         Article.objects.values_list('last_modified', flat=True).iterator())
+        with transaction.atomic():
+            ArchiveDay.objects.all().delete()
+            ArchiveDay.objects.bulk_create(ArchiveDay(date=day, article_count=count)
+                                           for day, count in counts.items())
+        self.stdout.write('Archive rebuilt for {} days'.format(len(counts)))
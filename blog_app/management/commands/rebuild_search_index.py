@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from blog_app.search import search_available, create_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Recreate the full text search index of all articles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not search_available():
+            raise CommandError('Full text search index requires SQLite with FTS5')
+        create_search_index()
+        indexed = rebuild_search_index(batch_size=options['batch_size'])
+        self.stdout.write('Indexed {} articles'.format(indexed))
@@ -0,0 +1,24 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.core.management.base import BaseCommand
+
+from blog_app.models import Article, Comment
+
+
+class Command(BaseCommand):
+    help = 'Recompute the comment count and last comment time of every article'
+
+    def handle(self, *args, **options):
+        comments = Comment.objects.filter(article_commented=OuterRef('pk')).order_by()
+        counts = comments.values('article_commented').annotate(count=Count('pk')).values('count')
+        newest = comments.order_by('-date').values('date')[:1]
+
+        # only rows that drifted are written, in a single statement
+        actual = Article.objects.annotate(actual_count=Coalesce(Subquery(counts), 0),
+                                          actual_last=Subquery(newest))
+        drifted = actual.exclude(Q(comment_count=F('actual_count')) &
+                                 (Q(last_comment=F('actual_last')) |
+                                  Q(last_comment__isnull=True, actual_last__isnull=True)))
+        updated = Article.objects.filter(pk__in=drifted.values('pk')).update(
+            comment_count=Coalesce(Subquery(counts), 0), last_comment=Subquery(newest))
+        self.stdout.write('Comment counts updated for {} articles'.format(updated))
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog_app.cache import (invalidate_groups, invalidate_category_fragments, category_group,
+                            HOMEPAGE_GROUP)
+from blog_app.models import Article, Category, make_excerpt
+from blog_app.rendering import render_body
+from blog_app.search import index_article
+from blog_app.signals import article_listing_groups
+
+
+class Command(BaseCommand):
+    help = 'Render the stored HTML of all articles again from their sources'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        articles = (Article.objects.exclude(body_source='')
+                                   .only('article_id', 'title', 'last_modified', 'article_body',
+                                         'body_source', 'body_format')
+                                   .order_by('pk'))
+        checked = 0
+        changed = []
+        last_pk = None
+        while True:
+            batch = articles if last_pk is None else articles.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                for article in batch:
+                    html = render_body(article.body_source, article.body_format)
+                    if html == article.article_body:
+                        continue
+                    article.article_body = html
+                    excerpt, word_count = make_excerpt(html)
+                    # update() leaves last_modified and the date archive untouched
+                    Article.objects.filter(pk=article.pk).update(article_body=html, excerpt=excerpt,
+                                                                 word_count=word_count)
+                    index_article(article)
+                    changed.append(article)
+            checked += len(batch)
+            last_pk = batch[-1].pk
+
+        if changed:
+            groups = [HOMEPAGE_GROUP]
+            for article in changed:
+                groups.extend(article_listing_groups(article.pk, article.last_modified))
+            names = (Category.objects.filter(article__in=[article.pk for article in changed])
+                                     .values_list('name', flat=True).distinct())
+            groups.extend(category_group(name) for name in names)
+            invalidate_groups(groups)
+            # article cards are keyed on last_modified, which did not move
+            invalidate_category_fragments()
+        self.stdout.write('Rendered {} articles, {} changed'.format(checked, len(changed)))
@@ -0,0 +1,40 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog_app.sitemaps import SECTIONS, chunk_starts, section_pages, sitemap_index, sitemap_urls
+
+
+class Command(BaseCommand):
+    help = 'Write the sitemap index and all sitemap chunks to a directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='e.g. a directory served by the web server at the site root')
+        parser.add_argument('--base-url', help='scheme and host, e.g. https://example.com')
+
+    def write(self, path, chunks):
+        # written next to the target and renamed, crawlers never see half a file
+        partial = path + '.tmp'
+        with open(partial, 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(partial, path)
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        base_url = (options['base_url'] or '').rstrip('/')
+        if not base_url.startswith(('http://', 'https://')):
+            raise CommandError('The base URL must start with http:// or https://')
+        os.makedirs(directory, exist_ok=True)
+
+        written = 0
+        for section in sorted(SECTIONS):
+            # each chunk starts where the previous one ended
+            for page, after in zip(range(1, section_pages(section) + 1), chunk_starts(section)):
+                filename = 'sitemap-{}-{}.xml'.format(section, page)
+                self.write(os.path.join(directory, filename),
+                           sitemap_urls(base_url, section, page, after))
+                written += 1
+        # the index goes last, so it only lists chunks that exist
+        self.write(os.path.join(directory, 'sitemap.xml'), sitemap_index(base_url))
+        self.stdout.write('Wrote the sitemap index and {} sitemaps'.format(written))
@@ -0,0 +1,196 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.backends.utils import CursorWrapper
+from django.template.base import Template
+
+# upper bounds of the latency histogram buckets in milliseconds, the last
+# bucket collects everything slower
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+FIELDS = (('requests', 'total_us', 'sql_us', 'sql_queries', 'template_us') +
+          tuple('bucket{}'.format(i) for i in range(len(BUCKETS) + 1)))
+NAMES_KEY = 'blog_app.metrics.names'
+UNRESOLVED = 'unresolved'
+
+_local = threading.local()
+_known_names = set()
+
+
+def get_metrics_cache():
+    return caches[getattr(settings, 'BLOG_METRICS_CACHE_ALIAS', 'default')]
+
+
+class RequestTimer:
+    """
+    Collects SQL and template timings of the request handled by the
+    current thread.
+    """
+
+    def __init__(self):
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.sql_queries = 0
+        self.sql_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def start(self):
+        self.started = time.perf_counter()
+        _local.timer = self
+
+    def stop(self):
+        _local.timer = None
+        self.total_seconds = time.perf_counter() - self.started
+
+    @property
+    def view_seconds(self):
+        return max(self.total_seconds - self.sql_seconds - self.template_seconds, 0)
+
+
+def instrument_templates():
+    """
+    Measure Template.render for the active timer. Included templates render
+    inside their parent, so only the outermost render is timed.
+    """
+    if getattr(Template.render, 'blog_app_instrumented', False):
+        return
+    original_render = Template.render
+
+    def render(self, context):
+        timer = getattr(_local, 'timer', None)
+        if timer is None or timer.template_depth:
+            return original_render(self, context)
+        timer.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original_render(self, context)
+        finally:
+            timer.template_seconds += time.perf_counter() - started
+            timer.template_depth -= 1
+
+    render.blog_app_instrumented = True
+    Template.render = render
+
+
+def _timed_query(method):
+    def timed(self, *args, **kwargs):
+        timer = getattr(_local, 'timer', None)
+        if timer is None:
+            return method(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            timer.sql_seconds += time.perf_counter() - started
+            timer.sql_queries += 1
+
+    timed.blog_app_instrumented = True
+    return timed
+
+
+def instrument_queries():
+    """
+    Measure the queries of every connection for the active timer. Debug
+    cursors run theirs through CursorWrapper too, so each is counted once,
+    and nothing depends on DEBUG or the length of the capped queries log.
+    """
+    if getattr(CursorWrapper.execute, 'blog_app_instrumented', False):
+        return
+    CursorWrapper.execute = _timed_query(CursorWrapper.execute)
+    CursorWrapper.executemany = _timed_query(CursorWrapper.executemany)
+
+
+def _key(name, field):
+    return 'blog_app.metrics.{}.{}'.format(name, field)
+
+
+def _incr(cache, key, delta):
+    # returns True when the key had to be created
+    try:
+        cache.incr(key, delta)
+        return False
+    except ValueError:
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+        return True
+
+
+def _register_name(cache, name):
+    # at most one read-modify-write of the name list per process and name
+    if name in _known_names:
+        return
+    names = cache.get(NAMES_KEY) or []
+    if name not in names:
+        cache.set(NAMES_KEY, names + [name], None)
+    _known_names.add(name)
+
+
+def record_request(name, timer):
+    cache = get_metrics_cache()
+    total_ms = timer.total_seconds * 1000
+    bucket = next((i for i, bound in enumerate(BUCKETS) if total_ms <= bound), len(BUCKETS))
+    values = {'requests': 1,
+              'total_us': int(timer.total_seconds * 1e6),
+              'sql_us': int(timer.sql_seconds * 1e6),
+              'sql_queries': timer.sql_queries,
+              'template_us': int(timer.template_seconds * 1e6),
+              'bucket{}'.format(bucket): 1}
+    for field, delta in values.items():
+        created = _incr(cache, _key(name, field), delta)
+        if field == 'requests' and created:
+            # first request of this name or the metrics were reset elsewhere
+            _known_names.discard(name)
+    _register_name(cache, name)
+
+
+def _bucket_label(i):
+    return '<={}ms'.format(BUCKETS[i]) if i < len(BUCKETS) else '>{}ms'.format(BUCKETS[-1])
+
+
+def _estimate_percentile(counts, requests, percent):
+    # upper bound of the bucket holding the percentile
+    threshold = requests * percent / 100
+    seen = 0
+    for i, count in enumerate(counts):
+        seen += count
+        if seen >= threshold:
+            return BUCKETS[i] if i < len(BUCKETS) else None
+    return None
+
+
+def get_metrics():
+    """
+    Aggregated metrics per URL name: request count, mean timings and the
+    latency histogram with percentiles estimated from it.
+    """
+    cache = get_metrics_cache()
+    names = cache.get(NAMES_KEY) or []
+    values = cache.get_many([_key(name, field) for name in names for field in FIELDS])
+
+    metrics = {}
+    for name in names:
+        totals = {field: values.get(_key(name, field), 0) for field in FIELDS}
+        requests = totals['requests']
+        if not requests:
+            continue
+        counts = [totals['bucket{}'.format(i)] for i in range(len(BUCKETS) + 1)]
+        metrics[name] = {
+            'requests': requests,
+            'mean_ms': round(totals['total_us'] / requests / 1000, 3),
+            'sql_ms_mean': round(totals['sql_us'] / requests / 1000, 3),
+            'sql_queries_mean': round(totals['sql_queries'] / requests, 2),
+            'template_ms_mean': round(totals['template_us'] / requests / 1000, 3),
+            'p50_ms': _estimate_percentile(counts, requests, 50),
+            'p95_ms': _estimate_percentile(counts, requests, 95),
+            'p99_ms': _estimate_percentile(counts, requests, 99),
+            'histogram': {_bucket_label(i): count for i, count in enumerate(counts)},
+        }
+    return metrics
+
+
+def reset_metrics():
+    cache = get_metrics_cache()
+    names = cache.get(NAMES_KEY) or []
+    cache.delete_many([_key(name, field) for name in names for field in FIELDS] + [NAMES_KEY])
+    _known_names.clear()
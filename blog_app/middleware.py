@@ -0,0 +1,155 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from .metrics import (RequestTimer, instrument_queries, instrument_templates,
+                      record_request, UNRESOLVED)
+from .routers import read_from_replica
+
+logger = logging.getLogger('blog_app.performance')
+
+
+class PerformanceMiddleware:
+    """
+    Time SQL queries, template rendering and the remaining view code of
+    every request. The timings are sent in a Server-Timing header, logged
+    as a JSON line to the 'blog_app.performance' logger and added to the
+    per URL name histograms of blog_app.metrics.
+
+    Put it first in MIDDLEWARE so that it times the whole request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_queries()
+        instrument_templates()
+
+    def __call__(self, request):
+        timer = RequestTimer()
+        timer.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            timer.stop()
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        name = resolver_match.view_name if resolver_match else UNRESOLVED
+        response['Server-Timing'] = ', '.join([
+            'sql;dur={:.2f};desc="{} queries"'.format(timer.sql_seconds * 1000, timer.sql_queries),
+            'template;dur={:.2f}'.format(timer.template_seconds * 1000),
+            'view;dur={:.2f}'.format(timer.view_seconds * 1000),
+            'total;dur={:.2f}'.format(timer.total_seconds * 1000),
+        ])
+        logger.info(json.dumps({
+            'url_name': name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(timer.total_seconds * 1000, 3),
+            'view_ms': round(timer.view_seconds * 1000, 3),
+            'sql_ms': round(timer.sql_seconds * 1000, 3),
+            'sql_queries': timer.sql_queries,
+            'template_ms': round(timer.template_seconds * 1000, 3),
+        }, sort_keys=True))
+        record_request(name, timer)
+        return response
+
+
+def get_profile_dir():
+    return getattr(settings, 'BLOG_PROFILE_DIR',
+                   os.path.join(tempfile.gettempdir(), 'blog_app_profiles'))
+
+
+class ProfilingMiddleware:
+    """
+    Profile a single request of a staff user with cProfile when the URL has
+    a `profile` parameter or the request an `X-Profile` header. The stats
+    are dumped to BLOG_PROFILE_DIR and the response is replaced with the
+    functions taking most cumulative time; `?profile=50` lists 50 of them.
+
+    Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def get_top(self, request):
+        value = request.GET.get('profile') or request.META.get('HTTP_X_PROFILE', '')
+        if value.isdigit() and int(value) > 0:
+            return int(value)
+        return getattr(settings, 'BLOG_PROFILE_TOP', 30)
+
+    def __call__(self, request):
+        requested = 'profile' in request.GET or 'HTTP_X_PROFILE' in request.META
+        if not requested or not request.user.is_staff:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        name = resolver_match.view_name if resolver_match else UNRESOLVED
+        directory = get_profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        filename = '{:%Y%m%d-%H%M%S-%f}-{}-{}.prof'.format(datetime.now(), re.sub(r'[^\w.-]', '_', name),
+                                                          os.getpid())
+        path = os.path.join(directory, filename)
+        profiler.dump_stats(path)
+
+        summary = io.StringIO()
+        summary.write('{} {} -> {}\nProfile saved to {}\n\n'.format(
+            request.method, request.get_full_path(), response.status_code, path))
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(self.get_top(request))
+        profile_response = HttpResponse(summary.getvalue(), content_type='text/plain; charset=utf-8')
+        profile_response['X-Profile-Path'] = path
+        return profile_response
+
+
+PRIMARY_COOKIE = 'blog_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serve the reads of safe requests from the replica database. Unsafe
+    requests (comments, signup, login) and the paths in
+    BLOG_PRIMARY_PATHS stay on the primary. After an unsafe request the
+    client gets a cookie which keeps its requests on the primary for
+    BLOG_REPLICA_STICKY_SECONDS, so it sees its own writes even if the
+    replica lags behind.
+
+    Streamed content is produced after the middleware returns, so it is
+    read from the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def use_replica(self, request):
+        if request.method not in SAFE_METHODS or PRIMARY_COOKIE in request.COOKIES:
+            return False
+        return not request.path.startswith(tuple(getattr(settings, 'BLOG_PRIMARY_PATHS', ['/admin'])))
+
+    def __call__(self, request):
+        if self.use_replica(request):
+            with read_from_replica():
+                return self.get_response(request)
+
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(PRIMARY_COOKIE, '1', httponly=True,
+                                max_age=getattr(settings, 'BLOG_REPLICA_STICKY_SECONDS', 10))
+        return response
@@ -1,8 +1,18 @@
 import uuid
 import re
-from django.db import models
+from datetime import datetime, time
+from html import unescape
+from django.conf import settings
+from django.db import models, IntegrityError, transaction
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from .rendering import BODY_FORMATS, HTML, render_body
+
+EXCERPT_WORDS = 50
+TAG = re.compile(r'<[^>]*>')
 
 
 def generate_id():
@@ -16,6 +26,32 @@ def remove_not_safe(text):
     return text
 
 
+def plain_text(html):
+    # a lot cheaper than strip_tags, good enough for counting and indexing
+    # words; the result is never rendered unescaped
+    return ' '.join(unescape(TAG.sub(' ', html)).split())
+
+
+def make_excerpt(html):
+    # same output as the truncatewords_html filter the listings used to apply
+    excerpt = Truncator(html).words(EXCERPT_WORDS, html=True, truncate=' ...')
+    word_count = len(plain_text(html).split())
+    return excerpt, word_count
+
+
+def start_of_day(date):
+    value = datetime.combine(date, time.min)
+    if settings.USE_TZ:
+        value = timezone.make_aware(value)
+    return value
+
+
+def local_date(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
 class Category(models.Model):
     name = models.CharField(max_length=20, blank=False)
 
@@ -30,6 +66,25 @@ class Category(models.Model):
         return reverse('category', args=[self.name])
 
 
+class ArticleQuerySet(models.QuerySet):
+
+    def for_listing(self):
+        # everything an article card needs, in a fixed number of queries
+        return self.defer('article_body', 'body_source').prefetch_related('category')
+
+    def modified_between(self, start, end):
+        # a half-open range over the indexed column instead of per-row
+        # year/month/day extraction
+        return (self.filter(last_modified__gte=start_of_day(start),
+                            last_modified__lt=start_of_day(end))
+                    .order_by('-last_modified', '-article_id'))
+
+    def last_modified(self):
+        # read from the end of the last_modified index; comments, category
+        # changes and deletions move the cache group versions instead
+        return self.order_by('-last_modified').values_list('last_modified', flat=True).first()
+
+
 class Article(models.Model):
     article_id = models.CharField(primary_key=True, 
                                   default=generate_id,
@@ -37,11 +92,38 @@ class Article(models.Model):
                                   max_length=6,
                                   unique=True)
     title = models.CharField(max_length=100, blank=False, null=False)
-    last_modified = models.DateField(auto_now=True)
+    created = models.DateTimeField(auto_now_add=True)
+    last_modified = models.DateTimeField(auto_now=True)
     category = models.ManyToManyField(Category)
     article_body = models.TextField(blank=False)
+    # when set, article_body is rendered from it on save
+    body_source = models.TextField(blank=True)
+    body_format = models.CharField(max_length=10, choices=BODY_FORMATS, default=HTML)
+    excerpt = models.TextField(blank=True, editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    # maintained by comment signals, see reconcile_comment_counts
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    last_comment = models.DateTimeField(null=True, blank=True, editable=False)
     slug = models.SlugField(blank=False)
 
+    objects = ArticleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # listings walk articles newest first, article_id breaks ties
+            models.Index(fields=['created', 'article_id']),
+            models.Index(fields=['last_modified', 'article_id']),
+        ]
+
+    def render_body(self):
+        if self.body_source:
+            self.article_body = render_body(self.body_source, self.body_format)
+
+    def save(self, *args, **kwargs):
+        self.render_body()
+        self.excerpt, self.word_count = make_excerpt(self.article_body)
+        super(Article, self).save(*args, **kwargs)
+
     def __str__(self):
         return self.title
 
@@ -49,11 +131,50 @@ class Article(models.Model):
         return reverse('article', args=[self.article_id, self.slug])
 
 
+class ArchiveDayQuerySet(models.QuerySet):
+
+    def count_between(self, start, end):
+        total = (self.filter(date__gte=start, date__lt=end)
+                     .aggregate(total=models.Sum('article_count'))['total'])
+        return total or 0
+
+    def add_articles(self, date, count=1):
+        updated = self.filter(date=date).update(article_count=models.F('article_count') + count)
+        if not updated and count > 0:
+            try:
+                with transaction.atomic():
+                    self.create(date=date, article_count=count)
+            except IntegrityError:
+                # created concurrently
+                self.filter(date=date).update(article_count=models.F('article_count') + count)
+        if count < 0:
+            self.filter(date=date, article_count__lte=0).delete()
+
+
+class ArchiveDay(models.Model):
+    """
+    Number of articles last modified on a given day, so archive pages can
+    tell they are empty without touching Article.
+    """
+    date = models.DateField(unique=True)
+    article_count = models.PositiveIntegerField(default=0)
+
+    objects = ArchiveDayQuerySet.as_manager()
+
+    def __str__(self):
+        return '{} - {}'.format(self.date, self.article_count)
+
+
 class Comment(models.Model):
     author = models.ForeignKey(User, null=False)
     article_commented = models.ForeignKey(Article, null=False)
     date = models.DateTimeField(auto_now_add=True)
     body = models.TextField(max_length=500, null=False, blank=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['article_commented', 'date']),
+        ]
+
     def __str__(self):
         return '{} - {}'.format(self.author, self.body[:20])
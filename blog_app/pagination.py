@@ -0,0 +1,151 @@
+import json
+import binascii
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections.abc import Sequence
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor_values(values):
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor_values(cursor, length):
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError, binascii.Error):
+        raise InvalidCursor('Malformed cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor('Malformed cursor')
+    return values
+
+
+class CountedPaginator(Paginator):
+    """
+    Page number paginator for listings whose size is already known, e.g.
+    from the date archive table, so it never runs a COUNT query.
+    """
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.known_count = count
+
+    @property
+    def count(self):
+        return self.known_count
+
+
+class CursorPage(Sequence):
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<CursorPage of {} objects>'.format(len(self))
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Keyset paginator. Instead of a page number, every page is addressed by
+    an opaque cursor holding the ordering values of a boundary row, so a page
+    costs a single indexed range query of per_page + 1 rows, without OFFSET
+    and without counting the whole listing.
+
+    `ordering` must end with a unique field and all fields have to be sorted
+    in the same direction.
+    """
+
+    def __init__(self, object_list, per_page, ordering=('-created', '-article_id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.descending = self.ordering[0].startswith('-')
+        self.field_names = tuple(name.lstrip('-') for name in self.ordering)
+        if any(name.startswith('-') != self.descending for name in self.ordering):
+            raise ValueError('All ordering fields must be sorted in the same direction')
+
+    def _get_fields(self):
+        opts = self.object_list.model._meta
+        return [opts.get_field(name) for name in self.field_names]
+
+    def encode_cursor(self, obj):
+        return encode_cursor_values([field.value_to_string(obj) for field in self._get_fields()])
+
+    def decode_cursor(self, cursor):
+        fields = self._get_fields()
+        values = decode_cursor_values(cursor, len(fields))
+        try:
+            return [field.to_python(value) for field, value in zip(fields, values)]
+        except (TypeError, ValidationError):
+            raise InvalidCursor('Malformed cursor')
+
+    def _seek(self, values, forward):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y)
+        lookup = 'lt' if self.descending == forward else 'gt'
+        condition = Q()
+        for i, name in enumerate(self.field_names):
+            exact = dict(zip(self.field_names[:i], values[:i]))
+            exact['{}__{}'.format(name, lookup)] = values[i]
+            condition |= Q(**exact)
+        return condition
+
+    def _reversed_ordering(self):
+        return [name[1:] if name.startswith('-') else '-' + name
+                for name in self.ordering]
+
+    def page(self, after=None, before=None):
+        """
+        Return the first page, the page following the `after` cursor or
+        the page preceding the `before` cursor.
+        """
+        queryset = self.object_list
+        if before is not None:
+            values = self.decode_cursor(before)
+            rows = list(queryset.filter(self._seek(values, forward=False))
+                                .order_by(*self._reversed_ordering())[:self.per_page + 1])
+            if len(rows) <= self.per_page:
+                # nothing newer than this page, show the canonical first page
+                return self.page()
+            rows = rows[:self.per_page][::-1]
+            return CursorPage(rows, self,
+                              next_cursor=self.encode_cursor(rows[-1]),
+                              previous_cursor=self.encode_cursor(rows[0]))
+
+        if after is not None:
+            values = self.decode_cursor(after)
+            queryset = queryset.filter(self._seek(values, forward=True))
+        rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+        if after is not None and not rows:
+            # cursor points past the end of the listing
+            return self.page()
+
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = self.encode_cursor(rows[-1])
+        previous_cursor = self.encode_cursor(rows[0]) if after is not None else None
+        return CursorPage(rows, self, next_cursor=next_cursor, previous_cursor=previous_cursor)
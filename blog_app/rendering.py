@@ -0,0 +1,128 @@
+from html import escape
+from html.parser import HTMLParser
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+HTML = 'html'
+MARKDOWN = 'markdown'
+BODY_FORMATS = (
+    (HTML, 'HTML'),
+    (MARKDOWN, 'Markdown'),
+)
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'dd', 'del', 'div', 'dl', 'dt', 'em',
+    'figcaption', 'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li',
+    'ol', 'p', 'pre', 'span', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'th',
+    'thead', 'tr', 'u', 'ul',
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'abbr': {'title'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+    '*': {'class'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_SCHEMES = ('http:', 'https:', 'mailto:')
+# the content of these is dropped together with the tags
+DROPPED_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+
+
+def _safe_url(url):
+    value = ''.join(url.split()).lower()
+    if ':' not in value.split('/', 1)[0]:
+        # relative URL
+        return True
+    return value.startswith(ALLOWED_SCHEMES)
+
+
+class Sanitizer(HTMLParser):
+    """
+    Whitelist sanitizer: keeps ALLOWED_TAGS with their ALLOWED_ATTRIBUTES,
+    escapes all text and drops everything else, closing tags left open.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.output = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set()) | ALLOWED_ATTRIBUTES['*']
+        parts = [tag]
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not _safe_url(value):
+                continue
+            parts.append('{}="{}"'.format(name, escape(value)))
+        self.output.append('<{}>'.format(' '.join(parts)))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in DROPPED_CONTENT_TAGS:
+            return
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # close everything opened inside the tag as well
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.output.append('</{}>'.format(open_tag))
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.output.append(escape(data, quote=False))
+
+    def sanitize(self, html):
+        self.feed(html)
+        self.close()
+        self.output.extend('</{}>'.format(tag) for tag in reversed(self.open_tags))
+        self.open_tags = []
+        return ''.join(self.output)
+
+
+def sanitize_html(html):
+    return Sanitizer().sanitize(html)
+
+
+def render_markdown(source):
+    if markdown is None:
+        raise ImproperlyConfigured('Markdown articles require the "markdown" package')
+    extensions = getattr(settings, 'BLOG_MARKDOWN_EXTENSIONS', ['markdown.extensions.extra'])
+    return markdown.markdown(source, extensions=extensions)
+
+
+def render_body(source, body_format):
+    """
+    Convert the source of an article to the sanitized HTML that is stored
+    and served.
+    """
+    if body_format == MARKDOWN:
+        source = render_markdown(source)
+    return sanitize_html(source)
@@ -0,0 +1,45 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_state = threading.local()
+
+
+def get_replica_alias():
+    return getattr(settings, 'BLOG_REPLICA_DATABASE', None)
+
+
+@contextmanager
+def read_from_replica():
+    """
+    Let reads made inside the block go to the replica. Everything outside
+    such a block, e.g. management commands, reads from the primary.
+    """
+    previous = getattr(_state, 'replica_reads', False)
+    _state.replica_reads = True
+    try:
+        yield
+    finally:
+        _state.replica_reads = previous
+
+
+class PrimaryReplicaRouter:
+    """
+    Send writes to the primary ('default') database and reads inside
+    read_from_replica() blocks to the BLOG_REPLICA_DATABASE alias.
+    """
+
+    def db_for_read(self, model, **hints):
+        replica = get_replica_alias()
+        if replica and getattr(_state, 'replica_reads', False):
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both databases hold the same rows
+        return True
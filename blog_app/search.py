@@ -0,0 +1,192 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Article, plain_text
+from .pagination import (CursorPage, CursorPaginator, InvalidCursor,
+                         encode_cursor_values, decode_cursor_values)
+
+FTS_TABLE = 'blog_app_article_fts'
+MAX_TERMS = 10
+# control characters never appear in article text, they mark matches in
+# snippets before the text gets escaped
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+
+
+def search_available(using_connection=None):
+    return (using_connection or connection).vendor == 'sqlite'
+
+
+def create_search_index(using_connection=None):
+    using_connection = using_connection or connection
+    if not search_available(using_connection):
+        return
+    with using_connection.cursor() as cursor:
+        cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS {} '
+                       'USING fts5(title, body, article_id UNINDEXED)'.format(FTS_TABLE))
+
+
+def _rowid(article_id):
+    # stable integer key for an article, unlike the rowid of the article
+    # table which VACUUM may renumber. Ids are case-sensitive, so every
+    # uppercase letter sets a bit above the base-36 value of the lowercased
+    # id (below 2**32 for six characters); lowercase ids keep their key.
+    uppercase = sum(1 << i for i, char in enumerate(article_id) if char.isupper())
+    return int(article_id.lower(), 36) + (uppercase << 32)
+
+
+INSERT_SQL = 'INSERT INTO {}(rowid, title, body, article_id) VALUES (%s, %s, %s, %s)'.format(FTS_TABLE)
+
+
+def _index_row(article_id, title, body):
+    return [_rowid(article_id), title, plain_text(body), article_id]
+
+
+def index_article(article):
+    if not search_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [_rowid(article.pk)])
+        cursor.execute(INSERT_SQL, _index_row(article.pk, article.title, article.article_body))
+
+
+def index_new_articles(articles):
+    # for articles created in bulk, which never had index rows
+    if not search_available():
+        return
+    # FTS5 appends rows in rowid order far faster than scattered ones
+    rows = sorted(_index_row(article.pk, article.title, article.article_body)
+                  for article in articles)
+    with connection.cursor() as cursor:
+        cursor.executemany(INSERT_SQL, rows)
+
+
+def unindex_article(article):
+    if not search_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(FTS_TABLE), [_rowid(article.pk)])
+
+
+def rebuild_search_index(batch_size=500):
+    articles = Article.objects.values_list('article_id', 'title', 'article_body').order_by()
+    indexed = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+        batch = []
+        for row in articles.iterator():
+            batch.append(_index_row(*row))
+            if len(batch) >= batch_size:
+                cursor.executemany(INSERT_SQL, batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(INSERT_SQL, batch)
+            indexed += len(batch)
+    return indexed
+
+
+def build_match_query(text):
+    """
+    Turn user input into an FTS5 query: every word is quoted so it can't be
+    parsed as query syntax, all words must match and the last one may be
+    the beginning of a word.
+    """
+    terms = re.findall(r'\w+', text)[:MAX_TERMS]
+    if not terms:
+        return ''
+    return ' '.join('"{}"'.format(term) for term in terms) + '*'
+
+
+def _highlight(text):
+    return mark_safe(escape(text).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>'))
+
+
+class SearchPaginator:
+    """
+    Ranked full text search over article titles and bodies with cursor
+    pagination on (rank, rowid).
+    """
+
+    def __init__(self, text, per_page):
+        self.query = build_match_query(text)
+        self.per_page = int(per_page)
+
+    def _search(self, seek=None, forward=True):
+        sql = ('SELECT article_id, rank, rowid, '
+               "highlight({table}, 0, %s, %s), snippet({table}, 1, %s, %s, '...', 32) "
+               'FROM {table} WHERE {table} MATCH %s'.format(table=FTS_TABLE))
+        params = [MATCH_START, MATCH_END, MATCH_START, MATCH_END, self.query]
+        if seek is not None:
+            rank, rowid = seek
+            op = '>' if forward else '<'
+            sql += ' AND (rank {op} %s OR (rank = %s AND rowid {op} %s))'.format(op=op)
+            params += [rank, rank, rowid]
+        sql += ' ORDER BY rank {0}, rowid {0} LIMIT %s'.format('ASC' if forward else 'DESC')
+        params.append(self.per_page + 1)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def _attach_articles(self, rows):
+        articles = Article.objects.for_listing().in_bulk([row[0] for row in rows])
+        results = []
+        for article_id, rank, rowid, title, snippet in rows:
+            article = articles.get(article_id)
+            if article is None:
+                continue
+            article.search_title = _highlight(title)
+            article.search_snippet = _highlight(snippet)
+            results.append(article)
+        return results
+
+    def _encode(self, row):
+        return encode_cursor_values([row[1], row[2]])
+
+    def _decode(self, cursor):
+        rank, rowid = decode_cursor_values(cursor, 2)
+        if not isinstance(rank, (int, float)) or not isinstance(rowid, int):
+            raise InvalidCursor('Malformed cursor')
+        return rank, rowid
+
+    def page(self, after=None, before=None):
+        if not self.query:
+            return CursorPage([], self)
+
+        if before is not None:
+            rows = self._search(self._decode(before), forward=False)
+            if len(rows) <= self.per_page:
+                return self.page()
+            rows = rows[:self.per_page][::-1]
+            return CursorPage(self._attach_articles(rows), self,
+                              next_cursor=self._encode(rows[-1]),
+                              previous_cursor=self._encode(rows[0]))
+
+        rows = self._search(self._decode(after) if after is not None else None)
+        if after is not None and not rows:
+            return self.page()
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = self._encode(rows[-1])
+        previous_cursor = self._encode(rows[0]) if after is not None else None
+        return CursorPage(self._attach_articles(rows), self,
+                          next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+
+def search_articles(text, per_page, after=None, before=None):
+    if search_available():
+        return SearchPaginator(text, per_page).page(after=after, before=before)
+
+    # other databases get a plain substring search over the newest articles
+    words = re.findall(r'\w+', text)[:MAX_TERMS]
+    if not words:
+        return CursorPage([], None)
+    articles = Article.objects.for_listing()
+    for word in words:
+        articles = articles.filter(Q(title__icontains=word) | Q(article_body__icontains=word))
+    return CursorPaginator(articles, per_page).page(after=after, before=before)
@@ -0,0 +1,218 @@
+import threading
+
+from django.db.models import F, OuterRef, Subquery
+from django.contrib.auth.models import Group
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .auth import forget_user
+from .cache import (invalidate_groups, article_group, category_group,
+                    date_groups, HOMEPAGE_GROUP, invalidate_category_fragments)
+from .models import Article, ArchiveDay, Category, Comment, User, local_date
+from .search import index_article, unindex_article
+
+
+# articles whose delete is running in this thread, their comments go with them
+_deleting = threading.local()
+
+
+def deleting_articles():
+    if not hasattr(_deleting, 'ids'):
+        _deleting.ids = set()
+    return _deleting.ids
+
+
+def article_listing_groups(article_id, last_modified):
+    groups = [article_group(article_id), HOMEPAGE_GROUP]
+    if last_modified is not None:
+        groups.extend(date_groups(last_modified))
+    return groups
+
+
+@receiver(pre_save, sender=Article)
+def remember_article_date(sender, instance, **kwargs):
+    # last_modified moves on every save, the old date archive changes too
+    instance._previous_last_modified = None
+    if not instance._state.adding:
+        instance._previous_last_modified = (Article.objects.filter(pk=instance.pk)
+                                            .values_list('last_modified', flat=True)
+                                            .first())
+
+
+@receiver(post_save, sender=Article)
+def invalidate_saved_article(sender, instance, **kwargs):
+    groups = article_listing_groups(instance.pk, instance.last_modified)
+    previous = getattr(instance, '_previous_last_modified', None)
+    if previous is not None:
+        groups.extend(date_groups(previous))
+    groups.extend(category_group(name)
+                  for name in instance.category.values_list('name', flat=True))
+    invalidate_groups(groups)
+
+
+@receiver(post_save, sender=Article)
+def update_archive_on_save(sender, instance, created, **kwargs):
+    new_date = local_date(instance.last_modified)
+    previous = getattr(instance, '_previous_last_modified', None)
+    if created or previous is None:
+        ArchiveDay.objects.add_articles(new_date)
+    elif local_date(previous) != new_date:
+        ArchiveDay.objects.add_articles(local_date(previous), -1)
+        ArchiveDay.objects.add_articles(new_date)
+
+
+@receiver(post_delete, sender=Article)
+def forget_deleted_article(sender, instance, **kwargs):
+    deleting_articles().discard(instance.pk)
+
+
+@receiver(post_delete, sender=Article)
+def update_archive_on_delete(sender, instance, **kwargs):
+    ArchiveDay.objects.add_articles(local_date(instance.last_modified), -1)
+
+
+@receiver(post_save, sender=Article)
+def update_search_index_on_save(sender, instance, **kwargs):
+    index_article(instance)
+
+
+@receiver(post_delete, sender=Article)
+def update_search_index_on_delete(sender, instance, **kwargs):
+    unindex_article(instance)
+
+
+@receiver(pre_delete, sender=Article)
+def invalidate_deleted_article(sender, instance, **kwargs):
+    deleting_articles().add(instance.pk)
+    groups = article_listing_groups(instance.pk, instance.last_modified)
+    groups.extend(category_group(name)
+                  for name in instance.category.values_list('name', flat=True))
+    invalidate_groups(groups)
+
+
+@receiver(m2m_changed, sender=Article.category.through)
+def invalidate_article_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # category.article_set was changed
+        categories = [instance]
+        articles = Article.objects.all()
+        if pk_set is not None:
+            articles = articles.filter(pk__in=pk_set)
+        else:
+            articles = articles.filter(category=instance)
+    else:
+        articles = [instance]
+        categories = Category.objects.all()
+        if pk_set is not None:
+            categories = categories.filter(pk__in=pk_set)
+        else:
+            categories = categories.filter(article=instance)
+
+    groups = [category_group(category.name) for category in categories]
+    for article in articles:
+        groups.extend(article_listing_groups(article.pk, article.last_modified))
+    invalidate_groups(groups)
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_name(sender, instance, **kwargs):
+    instance._previous_name = None
+    if instance.pk is not None:
+        instance._previous_name = (Category.objects.filter(pk=instance.pk)
+                                   .values_list('name', flat=True)
+                                   .first())
+
+
+def category_groups(category):
+    # category badges are rendered on every page that lists its articles
+    groups = [category_group(category.name), HOMEPAGE_GROUP]
+    previous = getattr(category, '_previous_name', None)
+    if previous is not None:
+        groups.append(category_group(previous))
+    if category.pk is not None:
+        for article_id, last_modified in (Article.objects.filter(category=category)
+                                          .values_list('article_id', 'last_modified')):
+            groups.extend(article_listing_groups(article_id, last_modified))
+    return groups
+
+
+@receiver(post_save, sender=Category)
+def invalidate_saved_category(sender, instance, **kwargs):
+    invalidate_groups(category_groups(instance))
+
+
+@receiver(pre_delete, sender=Category)
+def invalidate_deleted_category(sender, instance, **kwargs):
+    invalidate_groups(category_groups(instance))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_badges(sender, instance, **kwargs):
+    invalidate_category_fragments()
+
+
+@receiver(m2m_changed, sender=Article.category.through)
+def invalidate_article_badges(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_category_fragments()
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, using, **kwargs):
+    if created:
+        Article.objects.using(using).filter(pk=instance.article_commented_id).update(
+            comment_count=F('comment_count') + 1, last_comment=instance.date)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, using, **kwargs):
+    if instance.article_commented_id in deleting_articles():
+        return
+    newest = (Comment.objects.filter(article_commented=OuterRef('pk'))
+                             .order_by('-date').values('date')[:1])
+    Article.objects.using(using).filter(pk=instance.article_commented_id, comment_count__gt=0).update(
+        comment_count=F('comment_count') - 1, last_comment=Subquery(newest))
+
+
+def invalidate_commented_articles(article_ids):
+    # listings show the number of comments too
+    groups = [article_group(article_id) for article_id in article_ids]
+    groups.append(HOMEPAGE_GROUP)
+    for last_modified in (Article.objects.filter(pk__in=article_ids)
+                                         .values_list('last_modified', flat=True)):
+        groups.extend(date_groups(last_modified))
+    groups.extend(category_group(name) for name in Category.objects.filter(
+        article__in=article_ids).values_list('name', flat=True).distinct())
+    invalidate_groups(groups)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_commented_article(sender, instance, **kwargs):
+    if instance.article_commented_id in deleting_articles():
+        # the article's own delete invalidated its pages
+        return
+    invalidate_commented_articles([instance.article_commented_id])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_changed_user(sender, instance, **kwargs):
+    # password changes, deactivation, staff flags
+    forget_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def forget_user_with_changed_permissions(sender, instance, reverse, **kwargs):
+    # from the other side a group or permission changed, maybe for many users
+    forget_user(None if reverse else instance.pk)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_delete, sender=Group)
+def forget_users_of_changed_group(sender, **kwargs):
+    forget_user()
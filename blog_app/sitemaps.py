@@ -0,0 +1,98 @@
+import math
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.utils.html import escape
+
+from .models import Article, Category
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+# URLs sent to the client per chunk
+CHUNK_SIZE = 2000
+
+SECTIONS = {
+    'articles': lambda: Article.objects.only('article_id', 'slug', 'last_modified').order_by('pk'),
+    'categories': lambda: Category.objects.only('name').order_by('pk'),
+}
+
+
+def get_sitemap_limit():
+    # 50,000 URLs is the maximum the sitemap protocol allows per file
+    return getattr(settings, 'BLOG_SITEMAP_LIMIT', 50000)
+
+
+def section_pages(section):
+    return max(math.ceil(SECTIONS[section]().count() / get_sitemap_limit()), 1)
+
+
+def sitemap_index(base_url):
+    """
+    Yield the sitemap index listing every chunk of every section.
+    """
+    yield XML_HEADER + '<sitemapindex xmlns="{}">\n'.format(XMLNS)
+    for section in sorted(SECTIONS):
+        for page in range(1, section_pages(section) + 1):
+            location = base_url + reverse('sitemap', kwargs={'section': section, 'page': page})
+            yield '<sitemap><loc>{}</loc></sitemap>\n'.format(escape(location))
+    yield '</sitemapindex>\n'
+
+
+def chunk_start(section, page):
+    """
+    The primary key the chunk `page` of `section` starts after, None for
+    the first one. Only the primary key index is read up to the chunk.
+    """
+    if page <= 1:
+        return None
+    offset = (page - 1) * get_sitemap_limit()
+    keys = list(SECTIONS[section]().values_list('pk', flat=True)[offset - 1:offset])
+    return keys[0] if keys else None
+
+
+def chunk_starts(section):
+    """
+    chunk_start() of every chunk of `section` in order, found by seeking
+    from one chunk to the next.
+    """
+    limit = get_sitemap_limit()
+    keys = SECTIONS[section]().values_list('pk', flat=True)
+    after = None
+    while True:
+        yield after
+        rest = keys if after is None else keys.filter(pk__gt=after)
+        last = list(rest[limit - 1:limit])
+        if not last:
+            return
+        after = last[0]
+
+
+def sitemap_urls(base_url, section, page, after=None):
+    """
+    Yield the URLs of one chunk of a section, the rows after the primary key
+    `after` (looked up with chunk_start() when not given). Rows are read by
+    seeking on the primary key CHUNK_SIZE at a time and sent per group, so
+    no OFFSET scans the earlier rows and at most CHUNK_SIZE of them are in
+    memory, also on SQLite where iterator() can't stream.
+    """
+    if after is None:
+        after = chunk_start(section, page)
+    objects = SECTIONS[section]()
+    remaining = get_sitemap_limit()
+    yield XML_HEADER + '<urlset xmlns="{}">\n'.format(XMLNS)
+    while remaining > 0:
+        batch = objects if after is None else objects.filter(pk__gt=after)
+        batch = list(batch[:min(CHUNK_SIZE, remaining)])
+        if not batch:
+            break
+        lines = []
+        for obj in batch:
+            entry = '<url><loc>{}</loc>'.format(escape(base_url + obj.get_absolute_url()))
+            last_modified = getattr(obj, 'last_modified', None)
+            if last_modified is not None:
+                entry += '<lastmod>{}</lastmod>'.format(last_modified.date().isoformat())
+            lines.append(entry + '</url>\n')
+        yield ''.join(lines)
+        after = batch[-1].pk
+        remaining -= len(batch)
+    yield '</urlset>\n'
@@ -0,0 +1,71 @@
+import random
+import re
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, transaction
+
+# readers never block the writer and the writer never blocks readers,
+# commits only fsync at checkpoints
+WAL_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    # negative values are KiB
+    'cache_size': -20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+PRAGMA_NAME = re.compile(r'^\w+$')
+
+
+def get_pragmas():
+    pragmas = dict(WAL_PRAGMAS) if getattr(settings, 'BLOG_SQLITE_WAL', False) else {}
+    pragmas.update(getattr(settings, 'BLOG_SQLITE_PRAGMAS', {}))
+    return pragmas
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """
+    connection_created receiver setting the configured pragmas on every new
+    SQLite connection.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = get_pragmas()
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            if not PRAGMA_NAME.match(name):
+                raise ValueError('Invalid pragma name: {!r}'.format(name))
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def is_lock_error(error):
+    message = str(error)
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_on_lock(func, using=DEFAULT_DB_ALIAS):
+    """
+    Run func in a transaction and run it again when SQLite reports lock
+    contention, sleeping with jittered exponential backoff in between, at
+    most BLOG_SQLITE_WRITE_ATTEMPTS times in total.
+
+    A transaction that is already open can't be retried, so inside one func
+    runs only once.
+    """
+    if transaction.get_connection(using).in_atomic_block:
+        return func()
+
+    attempts = getattr(settings, 'BLOG_SQLITE_WRITE_ATTEMPTS', 5)
+    delay = getattr(settings, 'BLOG_SQLITE_RETRY_DELAY', 0.05)
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic(using=using):
+                return func()
+        except OperationalError as e:
+            if attempt == attempts or not is_lock_error(e):
+                raise
+        time.sleep(min(delay * 2 ** (attempt - 1), 1) * random.uniform(0.5, 1))
@@ -0,0 +1,24 @@
+// Fills the placeholders of the per-user widgets (login section, comment
+// form) of a page that is cached for everyone.
+(function () {
+    var script = document.currentScript;
+    if (!document.querySelector('[data-widget]')) {
+        return;
+    }
+    var request = new XMLHttpRequest();
+    request.open('GET', script.getAttribute('data-url'));
+    request.onload = function () {
+        if (request.status !== 200) {
+            return;
+        }
+        var widgets = JSON.parse(request.responseText);
+        var placeholders = document.querySelectorAll('[data-widget]');
+        for (var i = 0; i < placeholders.length; i++) {
+            var name = placeholders[i].getAttribute('data-widget');
+            if (widgets.hasOwnProperty(name)) {
+                placeholders[i].outerHTML = widgets[name];
+            }
+        }
+    };
+    request.send();
+})();
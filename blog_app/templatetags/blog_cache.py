@@ -0,0 +1,80 @@
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.templatetags.staticfiles import static
+from django.core.urlresolvers import reverse
+from django.utils.html import format_html
+
+from ..cache import (fragment_cache_enabled, get_fragment_cache, get_categories_version,
+                     fragment_cache_key, fragment_cache_stats, deferred_widgets_enabled,
+                     USER_WIDGETS)
+
+register = template.Library()
+
+
+class ArticleCacheNode(template.Node):
+
+    def __init__(self, nodelist, fragment_name, article):
+        self.nodelist = nodelist
+        self.fragment_name = fragment_name
+        self.article = article
+
+    def get_categories_version(self, context):
+        # looked up once per rendered template, not once per fragment
+        if 'blog_app.categories_version' not in context.render_context:
+            context.render_context['blog_app.categories_version'] = get_categories_version()
+        return context.render_context['blog_app.categories_version']
+
+    def render(self, context):
+        article = self.article.resolve(context)
+        if not fragment_cache_enabled() or getattr(article, 'last_modified', None) is None:
+            return self.nodelist.render(context)
+
+        cache = get_fragment_cache()
+        key = fragment_cache_key(self.fragment_name, article, self.get_categories_version(context))
+        value = cache.get(key)
+        if value is None:
+            fragment_cache_stats['misses'] += 1
+            value = self.nodelist.render(context)
+            cache.set(key, value, getattr(settings, 'BLOG_FRAGMENT_CACHE_TIMEOUT', 3600))
+        else:
+            fragment_cache_stats['hits'] += 1
+        return value
+
+
+@register.tag('articlecache')
+def do_article_cache(parser, token):
+    """
+    Cache the enclosed fragment of an article until the article or any
+    category changes:
+
+        {% articlecache card article %} ... {% endarticlecache %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(
+            "'{}' tag requires a fragment name and an article".format(bits[0]))
+    nodelist = parser.parse(('endarticlecache',))
+    parser.delete_first_token()
+    return ArticleCacheNode(nodelist, bits[1], parser.compile_filter(bits[2]))
+
+
+@register.simple_tag(takes_context=True)
+def user_widget(context, name):
+    """
+    Render a per-user widget in place or, with BLOG_DEFERRED_WIDGETS, an
+    empty placeholder that widgets.js fills in from the widgets view, which
+    keeps the page the same for every visitor.
+    """
+    if deferred_widgets_enabled():
+        return format_html('<div data-widget="{}"></div>', name)
+    widget = context.template.engine.get_template(USER_WIDGETS[name])
+    with context.push():
+        return widget.render(context)
+
+
+@register.simple_tag
+def user_widgets_script():
+    if not deferred_widgets_enabled():
+        return ''
+    return format_html('<script src="{}" data-url="{}" defer></script>',
+                       static('blog_app/widgets.js'), reverse('widgets'))
@@ -1,9 +1,20 @@
+from contextlib import contextmanager
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from blog_app.models import Category, Article, Comment, User
 from django.utils.text import slugify
 
 
 class CustomTestCase(TestCase):
+
+    @contextmanager
+    def assertMaxQueries(self, num):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        self.assertLessEqual(executed, num,
+                             '{} queries executed, at most {} expected'.format(executed, num))
     
     def get_new_category(self, *, name=None):
         new_category = Category.objects.create(name=name)
@@ -0,0 +1,303 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import override_settings
+from blog_app.cache import HOMEPAGE_GROUP, _group_key
+from blog_app.management.commands.import_articles import derive_article_id
+from blog_app.metrics import RequestTimer, get_metrics, record_request, reset_metrics
+from blog_app.models import Article, ArchiveDay, Category, Comment, make_excerpt
+from blog_app.search import SearchPaginator
+from .base import CustomTestCase
+
+
+class BackfillExcerptsCommandTest(CustomTestCase):
+
+    def test_backfill_recomputes_excerpts(self):
+        article = self.get_new_article(title='Test', article_body='one two three')
+        article.save()
+        Article.objects.filter(pk=article.pk).update(excerpt='', word_count=0)
+
+        out = StringIO()
+        call_command('backfill_excerpts', batch_size=1, stdout=out)
+        article.refresh_from_db()
+
+        self.assertEqual(article.excerpt, 'one two three')
+        self.assertEqual(article.word_count, 3)
+        self.assertIn('Updated 1 articles', out.getvalue())
+
+    @override_settings(BLOG_PAGE_CACHE=True, BLOG_FRAGMENT_CACHE=True,
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_backfill_refreshes_cached_listings(self):
+        caches['default'].clear()
+        category = self.get_new_category(name='python')
+        article = self.get_new_article(title='Test', article_body='fresh words', category=[category])
+        article.save()
+        Article.objects.filter(pk=article.pk).update(excerpt='stale words')
+        urls = ['/', '/category/python', article.last_modified.strftime('/%Y/%m/%d')]
+        for url in urls:
+            self.assertContains(self.client.get(url), 'stale words')
+
+        call_command('backfill_excerpts', stdout=StringIO())
+
+        for url in urls:
+            res = self.client.get(url)
+            self.assertNotContains(res, 'stale words')
+            self.assertContains(res, 'fresh words')
+
+
+class RebuildArchiveCommandTest(CustomTestCase):
+
+    def test_rebuild_recounts_articles_per_day(self):
+        for i in range(3):
+            self.get_new_article(title='Test{}'.format(i))
+        ArchiveDay.objects.all().delete()
+
+        out = StringIO()
+        call_command('rebuild_archive', stdout=out)
+
+        self.assertEqual(ArchiveDay.objects.get().article_count, 3)
+        self.assertIn('Archive rebuilt for 1 days', out.getvalue())
+
+
+class RebuildSearchIndexCommandTest(CustomTestCase):
+
+    def test_rebuild_indexes_all_articles(self):
+        article = self.get_new_article(title='Test', article_body='searchable')
+        article.save()
+
+        out = StringIO()
+        call_command('rebuild_search_index', batch_size=1, stdout=out)
+
+        self.assertEqual(list(SearchPaginator('searchable', 5).page()), [article])
+        self.assertIn('Indexed 1 articles', out.getvalue())
+
+
+class ReconcileCommentCountsCommandTest(CustomTestCase):
+
+    def test_reconcile_fixes_drifted_counters(self):
+        author = self.get_new_user(username='test_user', password='user_passwd123')
+        commented = self.get_new_article(title='Commented')
+        untouched = self.get_new_article(title='Untouched')
+        self.get_new_comment(author=author, article_commented=commented, body='Test')
+        # bulk_create bypasses the signals
+        Comment.objects.bulk_create([Comment(author=author, article_commented=commented, body='Bulk')])
+        Article.objects.filter(pk=untouched.pk).update(comment_count=3)
+
+        out = StringIO()
+        call_command('reconcile_comment_counts', stdout=out)
+        commented.refresh_from_db()
+        untouched.refresh_from_db()
+
+        self.assertEqual(commented.comment_count, 2)
+        self.assertEqual(commented.last_comment, Comment.objects.latest('date').date)
+        self.assertEqual(untouched.comment_count, 0)
+        self.assertIsNone(untouched.last_comment)
+        self.assertIn('updated for 2 articles', out.getvalue())
+
+
+class RenderArticlesCommandTest(CustomTestCase):
+
+    def test_render_updates_only_changed_articles(self):
+        stale = self.get_new_article(title='Stale')
+        stale.body_source = '<p>searchable</p>'
+        stale.save()
+        fresh = self.get_new_article(title='Fresh')
+        fresh.body_source = '<p>fresh</p>'
+        fresh.save()
+        # as left behind by an older renderer
+        Article.objects.filter(pk=stale.pk).update(article_body='<p>old</p>')
+        last_modified = Article.objects.get(pk=stale.pk).last_modified
+
+        out = StringIO()
+        call_command('render_articles', stdout=out)
+        stale.refresh_from_db()
+
+        self.assertEqual(stale.article_body, '<p>searchable</p>')
+        self.assertEqual(stale.excerpt, '<p>searchable</p>')
+        self.assertEqual(stale.last_modified, last_modified)
+        self.assertEqual(list(SearchPaginator('searchable', 5).page()), [stale])
+        self.assertIn('Rendered 2 articles, 1 changed', out.getvalue())
+
+
+class WriteSitemapsCommandTest(CustomTestCase):
+
+    def test_write_sitemaps(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        article = self.get_new_article(title='Article')
+        article.save()
+
+        out = StringIO()
+        with self.settings(BLOG_SITEMAP_LIMIT=1):
+            call_command('write_sitemaps', directory, base_url='https://example.com/', stdout=out)
+
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ['sitemap-articles-1.xml', 'sitemap-categories-1.xml', 'sitemap.xml'])
+        with open(os.path.join(directory, 'sitemap-articles-1.xml')) as f:
+            self.assertIn('<loc>https://example.com{}</loc>'.format(article.get_absolute_url()), f.read())
+        with open(os.path.join(directory, 'sitemap.xml')) as f:
+            self.assertIn('https://example.com/sitemap-categories-1.xml', f.read())
+        self.assertIn('2 sitemaps', out.getvalue())
+
+    def test_chunks_follow_each_other(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        articles = [self.get_new_article(title='Article{}'.format(i)) for i in range(5)]
+        for article in articles:
+            article.save()
+
+        with self.settings(BLOG_SITEMAP_LIMIT=2):
+            call_command('write_sitemaps', directory, base_url='https://example.com', stdout=StringIO())
+
+        content = ''
+        for page in range(1, 4):
+            with open(os.path.join(directory, 'sitemap-articles-{}.xml'.format(page))) as f:
+                content += f.read()
+        self.assertFalse(os.path.exists(os.path.join(directory, 'sitemap-articles-4.xml')))
+        for article in articles:
+            self.assertEqual(content.count(article.get_absolute_url() + '</loc>'), 1)
+
+
+class ImportArticlesCommandTest(CustomTestCase):
+
+    def write_input(self, content, suffix):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def import_articles(self, path, **options):
+        out = StringIO()
+        call_command('import_articles', path, stdout=out, **options)
+        return out.getvalue()
+
+    def test_import_jsonl_creates_articles_and_categories(self):
+        existing = self.get_new_category(name='python')
+        records = [{'title': 'First article', 'article_body': '<p>first body</p>',
+                    'categories': ['Python', 'django']},
+                   {'title': 'Second article', 'body': 'second body', 'categories': ['django']},
+                   {'title': '', 'article_body': 'no title'}]
+        path = self.write_input('\n'.join(json.dumps(record) for record in records), '.jsonl')
+
+        output = self.import_articles(path, batch_size=1)
+
+        self.assertIn('Imported 2 articles, skipped 1', output)
+        first = Article.objects.get(title='First article')
+        self.assertEqual(first.slug, 'first-article')
+        self.assertEqual(first.excerpt, '<p>first body</p>')
+        self.assertEqual(first.word_count, 2)
+        self.assertCountEqual(first.category.all(), [existing, Category.objects.get(name='django')])
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(ArchiveDay.objects.get().article_count, 2)
+        self.assertEqual(list(SearchPaginator('second', 5).page()),
+                         [Article.objects.get(title='Second article')])
+
+    def test_import_csv(self):
+        path = self.write_input('title,article_body,categories\n'
+                                'Csv article,csv body,one;two\n', '.csv')
+        self.import_articles(path)
+        article = Article.objects.get()
+        self.assertEqual(article.title, 'Csv article')
+        self.assertEqual(sorted(c.name for c in article.category.all()), ['one', 'two'])
+
+    def test_import_resolves_id_collisions_deterministically(self):
+        record = {'title': 'Title', 'article_body': 'body'}
+        seed = 'Title\0body'
+        taken = derive_article_id(seed, set())
+        Article.objects.create(article_id=taken, title='Existing', article_body='x', slug='x')
+        path = self.write_input(json.dumps(record), '.jsonl')
+
+        self.import_articles(path)
+
+        imported = Article.objects.get(title='Title')
+        self.assertEqual(imported.article_id, derive_article_id(seed, {taken}))
+        self.assertNotEqual(imported.article_id, taken)
+        self.assertEqual(Article.objects.get(article_id=taken).title, 'Existing')
+
+    def test_imported_rows_match_bulk_create(self):
+        # the import writes rows with its own SQL, it must not drift from the ORM
+        body = '<p>Some <b>body</b> text</p>'
+        path = self.write_input(json.dumps({'article_id': 'abc123', 'title': 'Title',
+                                            'slug': 'title', 'article_body': body}), '.jsonl')
+        self.import_articles(path)
+        excerpt, word_count = make_excerpt(body)
+        Article.objects.bulk_create([Article(article_id='xyz789', title='Title', slug='title',
+                                             article_body=body, excerpt=excerpt,
+                                             word_count=word_count)])
+
+        imported, created = [Article.objects.filter(pk=pk).values().get()
+                             for pk in ['abc123', 'xyz789']]
+        for row in (imported, created):
+            del row['article_id']
+            self.assertIsNotNone(row.pop('created'))
+            self.assertIsNotNone(row.pop('last_modified'))
+        self.assertEqual(imported, created)
+
+    def test_importing_twice_does_not_duplicate_articles(self):
+        records = [{'title': 'Title', 'article_body': 'body'},
+                   {'title': 'Title', 'article_body': 'body'},
+                   {'title': 'Other', 'article_body': 'body'}]
+        path = self.write_input('\n'.join(json.dumps(record) for record in records), '.jsonl')
+
+        self.assertIn('Imported 2 articles, skipped 1', self.import_articles(path))
+        self.assertIn('Imported 0 articles, skipped 3', self.import_articles(path))
+        self.assertEqual(Article.objects.count(), 2)
+
+    def test_import_skips_articles_with_existing_ids(self):
+        article = self.get_new_article(title='Existing', article_body='x')
+        path = self.write_input(json.dumps({'article_id': article.article_id,
+                                            'title': 'New', 'article_body': 'y'}), '.jsonl')
+        output = self.import_articles(path)
+        self.assertIn('Imported 0 articles, skipped 1', output)
+        self.assertFalse(Article.objects.filter(title='New').exists())
+
+
+@override_settings(BLOG_PAGE_CACHE=True,
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BlogBenchmarkCommandTest(CustomTestCase):
+
+    def test_benchmark_reports_every_route(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        caches['default'].clear()
+        caches['default'].set('sentinel', 'kept')
+        call_command('blog_benchmark', in_place=True, articles=12, categories=3, users=2,
+                     comments=20, days=5, requests=3, output=path, stdout=StringIO())
+        with open(path) as f:
+            report = json.load(f)
+
+        # the corpus was rolled back and the live cache left alone
+        self.assertEqual(Article.objects.count(), 0)
+        self.assertEqual(caches['default'].get('sentinel'), 'kept')
+        self.assertIsNone(caches['default'].get(_group_key(HOMEPAGE_GROUP)))
+        self.assertEqual(set(report['routes']), {
+            'homepage', 'category', 'article', 'by_year', 'by_month', 'by_day', 'search',
+            'signup', 'login', 'widgets', 'feed', 'category_feed', 'sitemap_index', 'sitemap',
+            'api_articles', 'api_article', 'api_categories', 'api_category', 'api_by_year',
+            'api_by_month', 'api_by_day', 'api_export'})
+        homepage = report['routes']['homepage']
+        self.assertLessEqual(homepage['p50_ms'], homepage['p99_ms'])
+        self.assertGreater(homepage['peak_memory_kb'], 0)
+        self.assertGreater(report['routes']['search']['queries_max'], 0)
+
+
+class DumpMetricsCommandTest(CustomTestCase):
+
+    def test_dump_prints_and_resets_metrics(self):
+        reset_metrics()
+        timer = RequestTimer()
+        timer.total_seconds = 0.02
+        record_request('homepage', timer)
+
+        out = StringIO()
+        call_command('dump_metrics', json=True, reset=True, stdout=out)
+
+        self.assertEqual(json.loads(out.getvalue())['homepage']['p50_ms'], 25)
+        self.assertEqual(get_metrics(), {})
@@ -1,5 +1,18 @@
+import os
+import shutil
+import tempfile
+import threading
+from datetime import date
 from django.core.exceptions import ValidationError
+from django.db import connections
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
 from django.utils.text import slugify
+from unittest import skipUnless
+from blog_app import rendering
+from blog_app.models import Article, ArchiveDay, Category, Comment, User
+from blog_app.rendering import sanitize_html
+from blog_app.sqlite import get_pragmas, retry_on_lock
 from .base import CustomTestCase
 
 
@@ -61,6 +74,16 @@ class ArticleModelTest(CustomTestCase):
         url = "/{hash}/{slug}".format(hash=article.article_id, slug=article.slug)
         self.assertEqual(url, article.get_absolute_url())
 
+    def test_article_stores_excerpt_and_word_count_on_save(self):
+        body = '<p>{}</p>'.format('word ' * 80)
+        article = self.get_new_article(title='My article title', article_body=body)
+        article.save()
+
+        self.assertEqual(article.word_count, 80)
+        self.assertTrue(article.excerpt.startswith('<p>word word'))
+        self.assertTrue(article.excerpt.endswith(' ...</p>'))
+        self.assertEqual(article.excerpt.count('word'), 50)
+
     def test_try_creating_article_without_title(self):
         category1 = self.get_new_category(name='test-category')
         test_article = {'title': '',
@@ -88,6 +111,78 @@ class ArticleModelTest(CustomTestCase):
             article.full_clean()
 
 
+class ArticleRenderingTest(CustomTestCase):
+
+    def test_sanitizer_keeps_allowed_markup(self):
+        html = '<p class="lead">Text <a href="/abc123/x" title="t">link</a><br/><img src="https://a/b.png" alt="b"></p>'
+        self.assertEqual(sanitize_html(html),
+                         '<p class="lead">Text <a href="/abc123/x" title="t">link</a><br>'
+                         '<img src="https://a/b.png" alt="b"></p>')
+
+    def test_sanitizer_removes_scripts_and_unsafe_attributes(self):
+        html = ('<p onclick="x()">a<script>alert(1)</script><style>p{}</style>'
+                '<a href=" JavaScript:alert(1)">b</a><iframe src="/x">c</iframe></p>')
+        self.assertEqual(sanitize_html(html), '<p>a<a>b</a></p>')
+
+    def test_sanitizer_escapes_text_and_closes_tags(self):
+        self.assertEqual(sanitize_html('<b>1 &lt; 2 <i>&amp; <unknown>x</b>'),
+                         '<b>1 &lt; 2 <i>&amp; x</i></b>')
+
+    def test_source_is_rendered_on_save(self):
+        article = self.get_new_article(title='Test')
+        article.body_source = '<p>Hello<script>alert(1)</script></p>'
+        article.save()
+        article.refresh_from_db()
+
+        self.assertEqual(article.article_body, '<p>Hello</p>')
+        self.assertEqual(article.excerpt, '<p>Hello</p>')
+
+    def test_articles_without_source_keep_their_body(self):
+        article = self.get_new_article(title='Test', article_body='<p onclick="x()">Legacy</p>')
+        article.save()
+        article.refresh_from_db()
+        self.assertEqual(article.article_body, '<p onclick="x()">Legacy</p>')
+
+    @skipUnless(rendering.markdown, 'markdown is not installed')
+    def test_markdown_source_is_rendered(self):
+        article = self.get_new_article(title='Test')
+        article.body_source = '# Title\n\nSome *text*'
+        article.body_format = rendering.MARKDOWN
+        article.save()
+        self.assertEqual(article.article_body, '<h1>Title</h1>\n<p>Some <em>text</em></p>')
+
+
+class ArchiveDayModelTest(CustomTestCase):
+
+    def test_archive_counts_saved_and_deleted_articles(self):
+        today = timezone.localtime(timezone.now()).date()
+        article1 = self.get_new_article(title='Test1')
+        article2 = self.get_new_article(title='Test2')
+        article1.save()
+
+        self.assertEqual(ArchiveDay.objects.get(date=today).article_count, 2)
+
+        article2.delete()
+        self.assertEqual(ArchiveDay.objects.count_between(today, date.max), 1)
+
+        article1.delete()
+        self.assertFalse(ArchiveDay.objects.exists())
+
+    def test_archive_moves_article_to_new_date(self):
+        article = self.get_new_article(title='Test')
+        old_day = date(2017, 5, 1)
+        old_timestamp = timezone.now().replace(year=2017, month=5, day=1)
+        Article.objects.filter(pk=article.pk).update(last_modified=old_timestamp)
+        ArchiveDay.objects.all().delete()
+        ArchiveDay.objects.create(date=old_day, article_count=1)
+
+        article.refresh_from_db()
+        article.save()
+
+        self.assertFalse(ArchiveDay.objects.filter(date=old_day).exists())
+        self.assertEqual(ArchiveDay.objects.get().article_count, 1)
+
+
 class CommentModelTest(CustomTestCase):
     
     def test_create_valid_comments(self):
@@ -130,4 +225,128 @@ class CommentModelTest(CustomTestCase):
         author1 = self.get_new_user(username='test_user', password='user_passwd123')
 
         with self.assertRaises(ValueError):
-            comment = self.get_new_comment(author=author1, body='Test')
\ No newline at end of file
+            comment = self.get_new_comment(author=author1, body='Test')
+
+    def test_comments_update_article_counters(self):
+        author = self.get_new_user(username='test_user', password='user_passwd123')
+        article = self.get_new_article()
+
+        first = self.get_new_comment(author=author, article_commented=article, body='First')
+        second = self.get_new_comment(author=author, article_commented=article, body='Second')
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 2)
+        self.assertEqual(article.last_comment, second.date)
+
+        second.delete()
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 1)
+        self.assertEqual(article.last_comment, first.date)
+
+        first.delete()
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 0)
+        self.assertIsNone(article.last_comment)
+
+    def test_deleting_article_does_not_query_per_comment(self):
+        author = self.get_new_user(username='test_user', password='user_passwd123')
+        article = self.get_new_article()
+        Comment.objects.bulk_create(Comment(author=author, article_commented=article, body='Comment')
+                                    for _ in range(50))
+        other = self.get_new_comment(author=author, article_commented=self.get_new_article(),
+                                     body='Other')
+
+        with self.assertMaxQueries(20):
+            article.delete()
+        self.assertFalse(Comment.objects.filter(body='Comment').exists())
+
+        # later comment deletes are counted again
+        other.delete()
+        self.assertEqual(Article.objects.get().comment_count, 0)
+
+
+class SQLitePragmasTest(SimpleTestCase):
+
+    @override_settings(BLOG_SQLITE_WAL=False)
+    def test_no_pragmas_by_default(self):
+        self.assertEqual(get_pragmas(), {})
+
+    @override_settings(BLOG_SQLITE_WAL=True, BLOG_SQLITE_PRAGMAS={'cache_size': -64000})
+    def test_overrides_are_merged_into_wal_profile(self):
+        pragmas = get_pragmas()
+        self.assertEqual(pragmas['journal_mode'], 'WAL')
+        self.assertEqual(pragmas['cache_size'], -64000)
+
+
+@override_settings(BLOG_SQLITE_WAL=True, BLOG_SQLITE_RETRY_DELAY=0.01)
+class SQLiteConcurrencyTest(SimpleTestCase):
+    """
+    Concurrent writers and readers on a file database, which unlike the
+    in-memory test database really has to lock.
+    """
+    alias = 'concurrency'
+    writers = 4
+    readers = 4
+    comments_per_writer = 25
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        connections.databases[self.alias] = {'ENGINE': 'django.db.backends.sqlite3',
+                                             'NAME': os.path.join(directory, 'blog.sqlite3')}
+        self.addCleanup(self.remove_database)
+        with connections[self.alias].schema_editor() as editor:
+            for model in (User, Category, Article, Comment):
+                editor.create_model(model)
+        self.user = User.objects.using(self.alias).create(username='writer')
+        # bulk_create skips the signals maintaining the default database
+        Article.objects.using(self.alias).bulk_create(
+            [Article(article_id='abcdef', title='Test', slug='test', article_body='Body')])
+
+    def remove_database(self):
+        connections[self.alias].close()
+        del connections.databases[self.alias]
+        if hasattr(connections._connections, self.alias):
+            delattr(connections._connections, self.alias)
+
+    def write(self, errors):
+        try:
+            for i in range(self.comments_per_writer):
+                retry_on_lock(lambda: Comment.objects.using(self.alias).create(
+                    author=self.user, article_commented_id='abcdef', body='Comment'), using=self.alias)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections[self.alias].close()
+
+    def read(self, errors, done):
+        try:
+            while not done.is_set():
+                list(Article.objects.using(self.alias).for_listing())
+                Comment.objects.using(self.alias).filter(article_commented_id='abcdef').count()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections[self.alias].close()
+
+    def test_concurrent_writes_and_reads(self):
+        errors = []
+        done = threading.Event()
+        readers = [threading.Thread(target=self.read, args=(errors, done))
+                   for i in range(self.readers)]
+        writers = [threading.Thread(target=self.write, args=(errors,))
+                   for i in range(self.writers)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.writers * self.comments_per_writer
+        self.assertEqual(Comment.objects.using(self.alias).count(), total)
+        self.assertEqual(Article.objects.using(self.alias).get().comment_count, total)
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
@@ -1,8 +1,33 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+from django.db import connection
 from django.http import HttpRequest
+from django.core.cache import caches
+from django.core.signals import request_started
 from django.core.urlresolvers import resolve
+from unittest import skipUnless
+from django.conf import settings
+from django.http import HttpResponse
+from django.contrib.auth.models import Permission
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, TransactionTestCase, modify_settings, override_settings
 from datetime import datetime
 from .base import CustomTestCase
 
+from .. import comment_queue
+from ..auth import CachedModelBackend, forget_user
+from ..cache import get_fragment_cache_stats
+from ..metrics import get_metrics, reset_metrics
+from ..middleware import ReplicaRoutingMiddleware
+from ..models import Article, Comment, User
+from ..throttling import get_throttle_stats, reset_buckets
+from ..routers import PrimaryReplicaRouter, get_replica_alias, read_from_replica
 from ..forms import (UserSignupForm, CommentForm, UserLoginForm)
 
 
@@ -27,6 +52,44 @@ class HomepageTest(CustomTestCase):
         self.assertIn(article1, loaded_articles)
         self.assertIn(article2, loaded_articles)
 
+    def test_home_page_paginates_newest_articles_first(self):
+        articles = [self.get_new_article(title='Test{}'.format(i)) for i in range(12)]
+        newest_first = articles[::-1]
+
+        res = self.client.get('/')
+        first_page = res.context['articles']
+        self.assertEqual(list(first_page), newest_first[:5])
+        self.assertFalse(first_page.has_previous())
+        self.assertTrue(first_page.has_next())
+
+        res = self.client.get('/', {'after': first_page.next_cursor})
+        second_page = res.context['articles']
+        self.assertEqual(list(second_page), newest_first[5:10])
+        self.assertTrue(second_page.has_previous())
+
+        res = self.client.get('/', {'after': second_page.next_cursor})
+        last_page = res.context['articles']
+        self.assertEqual(list(last_page), newest_first[10:])
+        self.assertFalse(last_page.has_next())
+
+        res = self.client.get('/', {'before': last_page.previous_cursor})
+        self.assertEqual(list(res.context['articles']), newest_first[5:10])
+
+        res = self.client.get('/', {'before': second_page.previous_cursor})
+        self.assertEqual(list(res.context['articles']), newest_first[:5])
+
+    def test_home_page_falls_back_to_first_page_on_invalid_cursor(self):
+        article = self.get_new_article(title='Test')
+        res = self.client.get('/', {'after': 'not-a-cursor'})
+        self.assertEqual(list(res.context['articles']), [article])
+
+    def test_home_page_renders_cursor_links(self):
+        for i in range(6):
+            self.get_new_article(title='Test{}'.format(i))
+        res = self.client.get('/')
+        self.assertContains(res, '?after={}'.format(res.context['articles'].next_cursor))
+        self.assertNotContains(res, '?before=')
+
 
 class CategoryTest(CustomTestCase):
     base_url = '/category/'
@@ -64,6 +127,19 @@ class CategoryTest(CustomTestCase):
         res = self.client.get(self.base_url + category1.name)
         self.assertNotIn(article2, res.context['articles'])
 
+    def test_category_page_paginates_with_cursor(self):
+        category1 = self.get_new_category(name='category1')
+        articles = [self.get_new_article(title='Test{}'.format(i), category=[category1, ])
+                    for i in range(7)]
+        self.get_new_article(title='Other')
+
+        res = self.client.get(self.base_url + category1.name)
+        first_page = res.context['articles']
+        self.assertEqual(list(first_page), articles[::-1][:5])
+
+        res = self.client.get(self.base_url + category1.name, {'after': first_page.next_cursor})
+        self.assertEqual(list(res.context['articles']), articles[::-1][5:])
+
     
 class SearchByDateTest(CustomTestCase):
     date_now = datetime.now()
@@ -127,6 +203,24 @@ class SearchByDateTest(CustomTestCase):
         self.assertIn(self.article, self.res2.context['articles'])
         self.assertIn(self.article, self.res3.context['articles'])
     
+    def test_search_date_pages_order_newest_first(self):
+        newer_article = self.get_new_article(title='Newer article', article_body='Test')
+        newer_article.save()
+        self.update_responses()
+
+        self.assertEqual(list(self.res1.context['articles']), [newer_article, self.article])
+        self.assertEqual(list(self.res3.context['articles']), [newer_article, self.article])
+
+    def test_search_empty_date_does_not_query_articles(self):
+        with self.assertMaxQueries(1):
+            res = self.client.get('/1999/01')
+        self.assertEqual(len(res.context['articles']), 0)
+
+    def test_search_invalid_date_finds_no_articles(self):
+        res = self.client.get('/{}/02/30'.format(self.current_year))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.context['articles']), 0)
+
     def test_search_date_page_displays_correct_info_texts(self):
         self.update_responses()
         self.assertContains(self.res1, 'Searching by date: {}'.format(self.current_year))
@@ -137,6 +231,928 @@ class SearchByDateTest(CustomTestCase):
                                                                             self.current_day))
 
 
+class ListingQueriesTest(CustomTestCase):
+    date_now = datetime.now()
+
+    def setUp(self):
+        self.category1 = self.get_new_category(name='category1')
+        self.category2 = self.get_new_category(name='category2')
+        for i in range(8):
+            article = self.get_new_article(title='Test{}'.format(i),
+                                           category=[self.category1, self.category2],
+                                           article_body='Test body')
+            article.save()
+
+    def get_listing_urls(self):
+        return ['/',
+                '/category/' + self.category1.name,
+                self.date_now.strftime('/%Y'),
+                self.date_now.strftime('/%Y/%m'),
+                self.date_now.strftime('/%Y/%m/%d')]
+
+    def test_listing_pages_query_count_does_not_depend_on_articles(self):
+        for url in self.get_listing_urls():
+            with self.assertMaxQueries(5):
+                res = self.client.get(url)
+            self.assertEqual(len(res.context['articles']), 5)
+
+    def test_date_pages_take_article_count_from_archive(self):
+        for url in self.get_listing_urls()[2:]:
+            with self.assertMaxQueries(5) as context:
+                res = self.client.get(url, {'page': 2})
+            self.assertEqual(res.context['articles'].paginator.num_pages, 2)
+            self.assertEqual(len(res.context['articles']), 3)
+            for query in context.captured_queries:
+                self.assertNotIn('COUNT(', query['sql'])
+
+    def test_listing_pages_do_not_load_article_body(self):
+        for url in self.get_listing_urls():
+            res = self.client.get(url)
+            for article in res.context['articles']:
+                self.assertIn('article_body', article.get_deferred_fields())
+            self.assertContains(res, 'Test body', count=5)
+
+    def test_listing_pages_render_categories_of_every_article(self):
+        for url in self.get_listing_urls():
+            res = self.client.get(url)
+            self.assertContains(res, self.category1.get_absolute_url(), count=5)
+            self.assertContains(res, self.category2.get_absolute_url(), count=5)
+
+
+@override_settings(BLOG_PAGE_CACHE=True,
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PageCacheTest(CustomTestCase):
+    date_now = datetime.now()
+
+    def setUp(self):
+        caches['default'].clear()
+        self.category = self.get_new_category(name='category')
+        self.article = self.get_new_article(title='Test article',
+                                            category=[self.category, ],
+                                            article_body='Test body')
+        self.article.save()
+        self.article_url = self.article.get_absolute_url()
+        self.user = self.get_new_user(username='test_user1', password='test_password123')
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        urls = ['/', self.category.get_absolute_url(), self.article_url,
+                self.date_now.strftime('/%Y/%m/%d')]
+        for url in urls:
+            res = self.client.get(url)
+            with self.assertNumQueries(0):
+                cached_res = self.client.get(url)
+            self.assertEqual(cached_res.status_code, 200)
+            self.assertContains(cached_res, 'Test article')
+
+    def test_cached_page_gets_fresh_csrf_token(self):
+        self.client.get('/')
+        res = self.client.get('/')
+        self.assertContains(res, 'csrfmiddlewaretoken')
+        self.assertNotContains(res, '__blog_app_csrf_token__')
+        self.assertIn('csrftoken', res.cookies)
+
+    def test_saving_article_invalidates_its_pages(self):
+        urls = ['/', self.category.get_absolute_url(), self.article_url,
+                self.date_now.strftime('/%Y'), self.date_now.strftime('/%Y/%m')]
+        for url in urls:
+            self.client.get(url)
+
+        self.article.title = 'Changed title'
+        self.article.save()
+
+        for url in urls:
+            self.assertContains(self.client.get(url), 'Changed title')
+
+    def test_adding_article_to_category_invalidates_category_page(self):
+        category2 = self.get_new_category(name='category2')
+        self.client.get(category2.get_absolute_url())
+
+        self.article.category.add(category2)
+
+        res = self.client.get(category2.get_absolute_url())
+        self.assertContains(res, 'Test article')
+
+    def test_comment_invalidates_article_and_listing_pages(self):
+        self.client.get('/')
+        self.client.get(self.article_url)
+        self.client.get(self.category.get_absolute_url())
+
+        self.get_new_comment(author=self.user, article_commented=self.article, body='New comment')
+
+        self.assertContains(self.client.get(self.article_url), 'New comment')
+        # listings show the number of comments
+        self.assertContains(self.client.get('/'), '1 comment<')
+        self.assertContains(self.client.get(self.category.get_absolute_url()), '1 comment<')
+
+    def test_authenticated_users_bypass_cache(self):
+        self.client.get('/')
+        self.client.login(username='test_user1', password='test_password123')
+        res = self.client.get('/')
+        self.assertContains(res, 'Logged in as test_user1')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                           'LOCATION': tempfile.mkdtemp()}})
+    def test_page_cache_works_with_file_based_cache(self):
+        self.addCleanup(shutil.rmtree, caches['default']._dir, True)
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            self.client.get('/')
+        self.article.title = 'Changed title'
+        self.article.save()
+        self.assertContains(self.client.get('/'), 'Changed title')
+
+
+@override_settings(BLOG_DEFERRED_WIDGETS=True, BLOG_PAGE_CACHE=True, BLOG_PUBLIC_MAX_AGE=3600,
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DeferredWidgetsTest(CustomTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.article = self.get_new_article(title='Test article', article_body='Test body')
+        self.article.save()
+        self.get_new_user(username='test_user1', password='test_password123')
+
+    def test_pages_are_the_same_for_every_visitor(self):
+        for url in ['/', self.article.get_absolute_url()]:
+            anonymous = self.client.get(url)
+            self.client.login(username='test_user1', password='test_password123')
+            logged_in = self.client.get(url)
+            self.client.logout()
+
+            self.assertEqual(anonymous.content, logged_in.content)
+            self.assertEqual(anonymous['ETag'], logged_in['ETag'])
+            self.assertContains(anonymous, 'data-widget="login"')
+            self.assertNotContains(anonymous, 'csrfmiddlewaretoken')
+            self.assertIn('public', anonymous['Cache-Control'])
+            self.assertIn('max-age=3600', anonymous['Cache-Control'])
+            self.assertNotIn('Cookie', anonymous.get('Vary', ''))
+
+    def test_widgets_view_renders_per_user_parts(self):
+        widgets = self.client.get('/widgets').json()
+        self.assertIn('csrfmiddlewaretoken', widgets['login'])
+        self.assertIn('Please log in', widgets['comment_form'])
+
+        self.client.login(username='test_user1', password='test_password123')
+        res = self.client.get('/widgets')
+        self.assertIn('private', res['Cache-Control'])
+        self.assertIn('Logged in as test_user1', res.json()['login'])
+        self.assertIn('csrfmiddlewaretoken', res.json()['comment_form'])
+
+
+@override_settings(BLOG_FRAGMENT_CACHE=True,
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class FragmentCacheTest(CustomTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.category = self.get_new_category(name='category')
+        self.article = self.get_new_article(title='Test article',
+                                            category=[self.category, ],
+                                            article_body='Test body')
+        self.article.save()
+
+    def test_article_cards_are_cached(self):
+        self.client.get('/')
+        before = get_fragment_cache_stats()
+        res = self.client.get('/')
+        after = get_fragment_cache_stats()
+
+        self.assertContains(res, 'Test article')
+        self.assertContains(res, self.category.get_absolute_url())
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'], before['misses'])
+
+    def test_editing_article_refreshes_its_card(self):
+        self.client.get('/')
+        self.article.title = 'Changed title'
+        self.article.save()
+        self.assertContains(self.client.get('/'), 'Changed title')
+
+    def test_renaming_category_refreshes_badges(self):
+        self.client.get('/')
+        self.client.get(self.article.get_absolute_url())
+        self.category.name = 'renamed'
+        self.category.save()
+
+        self.assertContains(self.client.get('/'), '/category/renamed')
+        self.assertContains(self.client.get(self.article.get_absolute_url()), '/category/renamed')
+
+    def test_adding_category_refreshes_badges(self):
+        self.client.get('/')
+        self.article.category.add(self.get_new_category(name='category2'))
+        self.assertContains(self.client.get('/'), '/category/category2')
+
+
+class ConditionalGetTest(CustomTestCase):
+
+    def setUp(self):
+        self.article = self.get_new_article(title='Test article', article_body='Test')
+        self.article.save()
+        self.article_url = self.article.get_absolute_url()
+        self.user = self.get_new_user(username='test_user1', password='test_password123')
+
+    def test_pages_emit_validators(self):
+        for url in ['/', self.article_url, '/category/test', datetime.now().strftime('/%Y')]:
+            res = self.client.get(url)
+            self.assertTrue(res.has_header('ETag'))
+        self.assertTrue(self.client.get('/').has_header('Last-Modified'))
+
+    def test_matching_etag_returns_not_modified_without_rendering(self):
+        etag = self.client.get('/')['ETag']
+        res = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertTemplateNotUsed(res, 'blog_app/homepage.html')
+
+    def test_if_modified_since_returns_not_modified(self):
+        last_modified = self.client.get('/')['Last-Modified']
+        res = self.client.get('/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(res.status_code, 304)
+
+    def test_new_article_changes_etag(self):
+        etag = self.client.get('/')['ETag']
+        self.get_new_article(title='Another article').save()
+        res = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+
+    def test_deleting_older_article_changes_etag(self):
+        older_article = self.get_new_article(title='Another article')
+        self.article.save()
+        etag = self.client.get('/')['ETag']
+        older_article.delete()
+        res = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+
+    def test_new_comment_changes_article_etag(self):
+        etag = self.client.get(self.article_url)['ETag']
+        self.get_new_comment(author=self.user, article_commented=self.article, body='test')
+        res = self.client.get(self.article_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+
+    def assertChangesHomepageEtag(self, change):
+        etag = self.client.get('/')['ETag']
+        change()
+        res = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+
+    def test_deleting_older_comment_changes_listing_etag(self):
+        older = self.get_new_comment(author=self.user, article_commented=self.article, body='old')
+        self.get_new_comment(author=self.user, article_commented=self.article, body='new')
+        self.assertChangesHomepageEtag(older.delete)
+
+    def test_revalidated_listing_shows_new_comment_count(self):
+        comment = self.get_new_comment(author=self.user, article_commented=self.article, body='test')
+        category = self.get_new_category(name='category')
+        self.article.category.add(category)
+        for url in ['/', category.get_absolute_url()]:
+            etag = self.client.get(url)['ETag']
+            comment.delete()
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertContains(res, '0 comments<')
+            comment = self.get_new_comment(author=self.user, article_commented=self.article, body='test')
+
+    def test_category_changes_change_listing_etag(self):
+        category = self.get_new_category(name='category')
+        self.assertChangesHomepageEtag(lambda: self.article.category.add(category))
+
+        def rename():
+            category.name = 'renamed'
+            category.save()
+        self.assertChangesHomepageEtag(rename)
+
+    def test_deleting_newest_article_moves_last_modified_forward(self):
+        older_article = self.get_new_article(title='Older article')
+        older_article.save()
+        self.article.save()
+        last_modified = self.client.get('/')['Last-Modified']
+
+        # Last-Modified has a resolution of one second
+        with mock.patch('blog_app.cache.time.time', return_value=time.time() + 5):
+            self.article.delete()
+            res = self.client.get('/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(res.status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        etag = self.client.get('/')['ETag']
+        self.client.login(username='test_user1', password='test_password123')
+        res = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(BLOG_PAGE_CACHE=True,
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cached_page_answers_not_modified_without_queries(self):
+        caches['default'].clear()
+        etag = self.client.get('/')['ETag']
+        with self.assertNumQueries(0):
+            res = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+
+
+class SearchTest(CustomTestCase):
+
+    def setUp(self):
+        self.article = self.get_new_article(title='Django performance',
+                                            article_body='<p>Profiling <b>queries</b> in views</p>')
+        self.article.save()
+        self.other_article = self.get_new_article(title='Gardening',
+                                                  article_body='<p>Growing tomatoes</p>')
+        self.other_article.save()
+
+    def test_search_page_renders_correct_template(self):
+        res = self.client.get('/search', {'q': 'django'})
+        self.assertTemplateUsed(res, 'blog_app/search.html')
+        self.assertIsInstance(res.context['login_form'], UserLoginForm)
+
+    def test_search_finds_matching_articles(self):
+        res = self.client.get('/search', {'q': 'queries'})
+        self.assertEqual(list(res.context['articles']), [self.article])
+
+    def test_search_matches_word_prefix(self):
+        res = self.client.get('/search', {'q': 'tomat'})
+        self.assertEqual(list(res.context['articles']), [self.other_article])
+
+    def test_ids_differing_in_case_are_indexed_separately(self):
+        lower = Article(article_id='abcdef', title='Lower', slug='lower', article_body='apples')
+        lower.save()
+        Article(article_id='ABCDEF', title='Upper', slug='upper', article_body='pears').save()
+
+        res = self.client.get('/search', {'q': 'apples'})
+        self.assertEqual(list(res.context['articles']), [lower])
+
+    def test_search_highlights_matches(self):
+        res = self.client.get('/search', {'q': 'django queries'})
+        self.assertContains(res, '<mark>Django</mark> performance')
+        self.assertContains(res, 'Profiling <mark>queries</mark> in views')
+
+    def test_search_ranks_better_matches_first(self):
+        better_article = self.get_new_article(title='Queries', article_body='queries queries queries')
+        better_article.save()
+        res = self.client.get('/search', {'q': 'queries'})
+        self.assertEqual(list(res.context['articles']), [better_article, self.article])
+
+    def test_search_paginates_with_cursor(self):
+        articles = []
+        for i in range(7):
+            article = self.get_new_article(title='Paged {}'.format(i), article_body='pagination')
+            article.save()
+            articles.append(article)
+
+        res = self.client.get('/search', {'q': 'pagination'})
+        first_page = res.context['articles']
+        res = self.client.get('/search', {'q': 'pagination', 'after': first_page.next_cursor})
+        second_page = res.context['articles']
+
+        self.assertEqual(len(first_page), 5)
+        self.assertEqual(len(second_page), 2)
+        self.assertCountEqual(list(first_page) + list(second_page), articles)
+        self.assertContains(res, 'q=pagination&amp;before=')
+
+    def test_search_index_follows_changes(self):
+        self.article.title = 'Renamed'
+        self.article.save()
+        self.other_article.delete()
+
+        self.assertEqual(list(self.client.get('/search', {'q': 'renamed'}).context['articles']),
+                         [self.article])
+        self.assertEqual(len(self.client.get('/search', {'q': 'django'}).context['articles']), 0)
+        self.assertEqual(len(self.client.get('/search', {'q': 'tomatoes'}).context['articles']), 0)
+
+    def test_search_ignores_query_syntax(self):
+        for query in ['"', 'AND OR (', 'NEAR(a b)', '*', '']:
+            res = self.client.get('/search', {'q': query})
+            self.assertEqual(res.status_code, 200)
+
+
+@modify_settings(MIDDLEWARE={'prepend': 'blog_app.middleware.PerformanceMiddleware'})
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PerformanceMiddlewareTest(CustomTestCase):
+
+    def setUp(self):
+        reset_metrics()
+        self.get_new_article(title='Test article')
+
+    def test_response_has_server_timing_header(self):
+        res = self.client.get('/')
+        timings = res['Server-Timing']
+        for metric in ['sql;dur=', 'template;dur=', 'view;dur=', 'total;dur=']:
+            self.assertIn(metric, timings)
+        self.assertNotIn('desc="0 queries"', timings)
+
+    def test_queries_are_counted_with_a_full_queries_log(self):
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/')
+        expected = 'desc="{} queries"'.format(len(queries))
+
+        def fill_queries_log(**kwargs):
+            # as a request that ran more queries than the log keeps
+            connection.queries_log.extend([{'sql': '', 'time': '0.000'}] * connection.queries_log.maxlen)
+
+        request_started.connect(fill_queries_log)
+        try:
+            res = self.client.get('/')
+        finally:
+            request_started.disconnect(fill_queries_log)
+            connection.queries_log.clear()
+        self.assertNotEqual(expected, 'desc="0 queries"')
+        self.assertIn(expected, res['Server-Timing'])
+
+    def test_requests_are_aggregated_per_url_name(self):
+        for _ in range(3):
+            self.client.get('/')
+        self.client.get('/signup')
+
+        metrics = get_metrics()
+        self.assertEqual(metrics['homepage']['requests'], 3)
+        self.assertEqual(metrics['signup']['requests'], 1)
+        self.assertEqual(sum(metrics['homepage']['histogram'].values()), 3)
+        self.assertGreater(metrics['homepage']['sql_queries_mean'], 0)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        self.client.get('/')
+        self.assertTemplateUsed(self.client.get('/metrics'), 'blog_app/404.html')
+
+        staff = self.get_new_user(username='staff', password='password')
+        staff.is_staff = True
+        staff.save()
+        self.client.force_login(staff)
+        res = self.client.get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        data = res.json()
+        self.assertEqual(data['routes']['homepage']['requests'], 1)
+        self.assertIn('hits', data['fragment_cache'])
+        self.assertIn('throttling', data)
+
+
+@modify_settings(MIDDLEWARE={'append': 'blog_app.middleware.ProfilingMiddleware'})
+class ProfilingMiddlewareTest(CustomTestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        self.settings_override = override_settings(BLOG_PROFILE_DIR=self.profile_dir)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.user = self.get_new_user(username='staff', password='password')
+
+    def test_profile_is_ignored_for_non_staff(self):
+        self.client.force_login(self.user)
+        res = self.client.get('/', {'profile': ''})
+        self.assertTemplateUsed(res, 'blog_app/homepage.html')
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_staff_gets_profile_summary(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+        res = self.client.get('/', {'profile': '5'})
+
+        self.assertEqual(res['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertIn('cumulative', res.content.decode())
+        dumps = os.listdir(self.profile_dir)
+        self.assertEqual(len(dumps), 1)
+        self.assertIn('homepage', dumps[0])
+        self.assertEqual(res['X-Profile-Path'], os.path.join(self.profile_dir, dumps[0]))
+
+    def test_staff_can_profile_with_header(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+        res = self.client.get('/', HTTP_X_PROFILE='1')
+        self.assertTrue(res.has_header('X-Profile-Path'))
+
+
+class FeedTest(CustomTestCase):
+
+    def setUp(self):
+        self.category = self.get_new_category(name='python')
+        self.article = self.get_new_article(title='Feed article', category=[self.category],
+                                            article_body='<p>Feed body</p>')
+        self.article.save()
+        self.other = self.get_new_article(title='Other article', article_body='Other body')
+        self.other.save()
+
+    def get_feed(self, url, **headers):
+        res = self.client.get(url, **headers)
+        content = b''.join(res.streaming_content) if res.streaming else res.content
+        return res, content.decode()
+
+    def test_site_feeds_list_all_articles(self):
+        res, content = self.get_feed('/feeds/rss')
+        self.assertTrue(res.streaming)
+        self.assertEqual(res['Content-Type'], 'application/rss+xml; charset=utf-8')
+        self.assertIn('<title>Feed article</title>', content)
+        self.assertIn('<title>Other article</title>', content)
+        self.assertIn('<category>python</category>', content)
+        self.assertIn('http://testserver' + self.article.get_absolute_url(), content)
+
+        res, content = self.get_feed('/feeds/atom')
+        self.assertEqual(res['Content-Type'], 'application/atom+xml; charset=utf-8')
+        self.assertEqual(content.count('<entry>'), 2)
+
+    def test_category_feed_lists_category_articles(self):
+        res, content = self.get_feed('/feeds/category/python/atom')
+        self.assertIn('Feed article', content)
+        self.assertNotIn('Other article', content)
+
+    def test_feed_supports_conditional_get(self):
+        res = self.client.get('/feeds/rss')
+        self.assertTrue(res.has_header('Last-Modified'))
+        res = self.client.get('/feeds/rss', HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+
+    @override_settings(BLOG_PAGE_CACHE=True,
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_feed_is_cached_until_an_article_changes(self):
+        caches['default'].clear()
+        first, content = self.get_feed('/feeds/category/python/rss')
+
+        with self.assertMaxQueries(2):
+            cached, cached_content = self.get_feed('/feeds/category/python/rss')
+        self.assertFalse(cached.streaming)
+        self.assertEqual(cached_content, content)
+
+        self.article.title = 'Renamed article'
+        self.article.save()
+        res, content = self.get_feed('/feeds/category/python/rss')
+        self.assertIn('Renamed article', content)
+
+
+@override_settings(BLOG_SITEMAP_LIMIT=2)
+class SitemapTest(CustomTestCase):
+
+    def setUp(self):
+        self.category = self.get_new_category(name='python')
+        self.articles = [self.get_new_article(title='Article{}'.format(i)) for i in range(3)]
+        for article in self.articles:
+            article.save()
+
+    def get_content(self, url):
+        res = self.client.get(url)
+        self.assertEqual(res['Content-Type'], 'application/xml')
+        return b''.join(res.streaming_content).decode()
+
+    def test_index_lists_every_chunk(self):
+        content = self.get_content('/sitemap.xml')
+        for name in ['articles-1', 'articles-2', 'categories-1']:
+            self.assertIn('<loc>http://testserver/sitemap-{}.xml</loc>'.format(name), content)
+        self.assertNotIn('articles-3', content)
+
+    def test_chunks_list_articles_and_categories(self):
+        content = self.get_content('/sitemap-articles-1.xml') + self.get_content('/sitemap-articles-2.xml')
+        for article in self.articles:
+            self.assertEqual(content.count('http://testserver' + article.get_absolute_url()), 1)
+        self.assertIn('<lastmod>', content)
+
+        content = self.get_content('/sitemap-categories-1.xml')
+        self.assertIn('http://testserver' + self.category.get_absolute_url(), content)
+
+    def test_chunks_seek_by_primary_key(self):
+        with CaptureQueriesContext(connection) as queries, mock.patch('blog_app.sitemaps.CHUNK_SIZE', 1):
+            content = self.get_content('/sitemap-articles-2.xml')
+        self.assertEqual(content.count('<url>'), 1)
+        # only the primary key index is skipped through, never the rows
+        for query in queries.captured_queries:
+            if 'OFFSET' in query['sql']:
+                self.assertNotIn('"title"', query['sql'])
+                self.assertNotIn('"slug"', query['sql'])
+
+    def test_missing_chunks_are_not_found(self):
+        for url in ['/sitemap-articles-3.xml', '/sitemap-articles-0.xml', '/sitemap-users-1.xml']:
+            self.assertTemplateUsed(self.client.get(url), 'blog_app/404.html')
+
+
+class ApiTest(CustomTestCase):
+    date_now = datetime.now()
+
+    def setUp(self):
+        self.category = self.get_new_category(name='python')
+        self.articles = []
+        for i in range(25):
+            article = self.get_new_article(title='Article{}'.format(i), category=[self.category],
+                                           article_body='<p>Body {}</p>'.format(i))
+            article.save()
+            self.articles.append(article)
+
+    def test_article_list_is_cursor_paginated(self):
+        data = self.client.get('/api/articles').json()
+        self.assertEqual(len(data['results']), 20)
+        self.assertIsNone(data['previous'])
+        self.assertEqual(data['results'][0]['title'], 'Article24')
+        self.assertEqual(data['results'][0]['categories'], ['python'])
+
+        data = self.client.get(data['next']).json()
+        self.assertEqual([article['title'] for article in data['results']],
+                         ['Article{}'.format(i) for i in range(4, -1, -1)])
+        self.assertIsNone(data['next'])
+        self.assertIsNotNone(data['previous'])
+
+    def test_sparse_fieldsets_load_only_needed_columns(self):
+        with self.assertMaxQueries(3) as context:
+            res = self.client.get('/api/articles', {'fields': 'id,title'})
+        self.assertEqual(set(res.json()['results'][0]), {'id', 'title'})
+        for query in context.captured_queries:
+            self.assertNotIn('excerpt', query['sql'])
+            self.assertNotIn('blog_app_category', query['sql'])
+
+        data = self.client.get(res.json()['next']).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'title'})
+
+    @override_settings(BLOG_PAGE_CACHE=True,
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cached_responses_keep_the_host_and_scheme_of_their_links(self):
+        caches['default'].clear()
+        self.client.get('/api/articles', HTTP_HOST='a.example')
+        data = self.client.get('/api/articles', HTTP_HOST='b.example', secure=True).json()
+        self.assertTrue(data['next'].startswith('https://b.example/'))
+        self.assertTrue(data['results'][0]['url'].startswith('https://b.example/'))
+
+        url = '/api/articles/' + self.articles[0].article_id
+        self.client.get(url, HTTP_HOST='a.example')
+        data = self.client.get(url, HTTP_HOST='b.example').json()
+        self.assertTrue(data['url'].startswith('http://b.example/'))
+
+    def test_unknown_fields_are_rejected(self):
+        res = self.client.get('/api/articles', {'fields': 'title,password'})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json(), {'error': 'Unknown fields: password'})
+
+    def test_category_and_date_lists(self):
+        data = self.client.get('/api/category/python', {'fields': 'id'}).json()
+        self.assertEqual(len(data['results']), 20)
+        self.assertEqual(self.client.get('/api/category/missing').status_code, 404)
+
+        for url in [self.date_now.strftime('/api/%Y'), self.date_now.strftime('/api/%Y/%m'),
+                    self.date_now.strftime('/api/%Y/%m/%d')]:
+            data = self.client.get(url).json()
+            self.assertEqual(len(data['results']), 20)
+            self.assertEqual(len(self.client.get(data['next']).json()['results']), 5)
+        self.assertEqual(self.client.get('/api/1990').json()['results'], [])
+
+    def test_article_with_comments(self):
+        article = self.articles[0]
+        user = self.get_new_user(username='test_user', password='test_password')
+        self.get_new_comment(author=user, article_commented=article, body='Nice')
+
+        data = self.client.get('/api/articles/' + article.pk).json()
+        self.assertEqual(data['body'], '<p>Body 0</p>')
+        self.assertEqual(data['comments']['results'][0]['author'], 'test_user')
+        self.assertEqual(data['comments']['results'][0]['body'], 'Nice')
+        self.assertEqual(self.client.get('/api/articles/zzzzzz').status_code, 404)
+
+    def test_categories(self):
+        data = self.client.get('/api/categories').json()
+        self.assertEqual(data['results'][0]['name'], 'python')
+        self.assertEqual(data['results'][0]['api_url'], 'http://testserver/api/category/python')
+
+    def test_export_streams_json_lines(self):
+        res = self.client.get('/api/export/articles.ndjson', {'fields': 'id,categories'})
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 25)
+        self.assertEqual(json.loads(lines[0]), {'id': min(a.pk for a in self.articles),
+                                                'categories': ['python']})
+
+
+@override_settings(BLOG_REPLICA_DATABASE='replica')
+class ReplicaRoutingTest(CustomTestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        self.middleware = ReplicaRoutingMiddleware(self.get_response)
+
+    def get_response(self, request):
+        # reports where the view would have read from
+        return HttpResponse(self.router.db_for_read(Article))
+
+    def test_reads_go_to_replica_only_when_allowed(self):
+        self.assertEqual(self.router.db_for_read(Article), 'default')
+        with read_from_replica():
+            self.assertEqual(self.router.db_for_read(Article), 'replica')
+            self.assertEqual(self.router.db_for_write(Article), 'default')
+        self.assertEqual(self.router.db_for_read(Article), 'default')
+
+    def test_safe_requests_read_from_replica(self):
+        res = self.middleware(self.factory.get('/'))
+        self.assertEqual(res.content, b'replica')
+        self.assertNotIn('blog_primary', res.cookies)
+
+    def test_writes_and_admin_stay_on_primary(self):
+        res = self.middleware(self.factory.post('/abcdef/slug', {'body': 'Test'}))
+        self.assertEqual(res.content, b'default')
+        self.assertEqual(res.cookies['blog_primary']['max-age'], 10)
+
+        self.assertEqual(self.middleware(self.factory.get('/admin/')).content, b'default')
+
+    def test_writers_read_their_writes_from_primary(self):
+        request = self.factory.get('/')
+        request.COOKIES['blog_primary'] = '1'
+        self.assertEqual(self.middleware(request).content, b'default')
+
+    @override_settings(BLOG_REPLICA_DATABASE=None)
+    def test_without_replica_everything_uses_primary(self):
+        self.assertEqual(self.middleware(self.factory.get('/')).content, b'default')
+
+
+@skipUnless(get_replica_alias() in settings.DATABASES,
+            'needs a BLOG_REPLICA_DATABASE, e.g. a second SQLite file')
+@modify_settings(MIDDLEWARE={'prepend': 'blog_app.middleware.ReplicaRoutingMiddleware'})
+@override_settings(DATABASE_ROUTERS=['blog_app.routers.PrimaryReplicaRouter'])
+class PrimaryReplicaTest(CustomTestCase):
+    multi_db = True
+
+    def test_reads_come_from_replica_until_the_user_writes(self):
+        # nothing is replicated between the two test databases, so every read
+        # shows which of them answered
+        article = self.get_new_article(title='Primary article')
+        article.save()
+        self.get_new_user(username='test_user', password='test_password')
+
+        self.assertNotContains(self.client.get('/'), 'Primary article')
+
+        self.client.post('/login', {'username': 'test_user', 'password': 'test_password'})
+        self.client.post(article.get_absolute_url(), {'body': 'My comment'})
+        self.assertContains(self.client.get(article.get_absolute_url()), 'My comment')
+
+        del self.client.cookies['blog_primary']
+        self.assertNotContains(self.client.get('/'), 'Primary article')
+
+
+@override_settings(BLOG_COMMENT_QUEUE=True, BLOG_PAGE_CACHE=True,
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CommentQueueTest(CustomTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.spool = os.path.join(directory, 'comments.spool')
+        # not started, so nothing is written behind the test's back
+        comment_queue._comment_queue = comment_queue.CommentQueue(spool=self.spool)
+        self.addCleanup(setattr, comment_queue, '_comment_queue', None)
+
+        self.article = self.get_new_article(title='Test article', article_body='Test body')
+        self.article.save()
+        self.get_new_user(username='test_user', password='test_password')
+        self.client.login(username='test_user', password='test_password')
+
+    def test_queued_comments_survive_a_restart(self):
+        url = self.article.get_absolute_url()
+        self.client.get(url)
+        self.client.post(url, {'body': 'First comment'})
+        self.client.post(url, {'body': 'Second comment'})
+        self.assertFalse(Comment.objects.exists())
+
+        # a new process finds the comments in the spool and writes them
+        restarted = comment_queue.CommentQueue(spool=self.spool)
+        entries = restarted._read_spool()
+        self.assertEqual([entry['body'] for entry in entries], ['First comment', 'Second comment'])
+        with self.assertNumQueries(8):
+            restarted.write(entries)
+
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.comment_count, 2)
+        self.assertEqual(self.article.last_comment, Comment.objects.latest('date').date)
+        self.assertEqual(restarted._read_spool(), [])
+        self.client.logout()
+        self.assertContains(self.client.get(url), 'Second comment')
+
+    def test_comments_of_deleted_articles_are_dropped(self):
+        self.client.post(self.article.get_absolute_url(), {'body': 'Late comment'})
+        entries = comment_queue.CommentQueue(spool=self.spool)._read_spool()
+        self.article.delete()
+
+        comment_queue.CommentQueue(spool=self.spool).write(entries)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_anonymous_comments_are_not_queued(self):
+        self.client.logout()
+        self.client.post(self.article.get_absolute_url(), {'body': 'Anonymous comment'})
+        self.assertEqual(comment_queue.CommentQueue(spool=self.spool)._read_spool(), [])
+
+    def test_bad_comments_do_not_sink_their_batch(self):
+        url = self.article.get_absolute_url()
+        self.client.post(url, {'body': 'Good comment'})
+        gone = self.get_new_user(username='gone_user', password='test_password')
+        self.client.force_login(gone)
+        self.client.post(url, {'body': 'Comment of a deleted user'})
+        entries = comment_queue.CommentQueue(spool=self.spool)._read_spool()
+        gone.delete()
+        entries.append(dict(entries[0], id='anonymous', author_id=None))
+        # rejected by the NOT NULL constraint
+        entries.append(dict(entries[0], id='broken', body=None))
+
+        queue = comment_queue.CommentQueue(spool=self.spool)
+        with self.assertLogs('blog_app.comments', 'ERROR'):
+            queue.write(entries)
+
+        self.assertEqual(list(Comment.objects.values_list('body', flat=True)), ['Good comment'])
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.comment_count, 1)
+        self.assertEqual(queue._read_spool(), [])
+
+
+class CommentQueueWorkerTest(TransactionTestCase):
+
+    def test_worker_writes_batches(self):
+        user = User.objects.create_user('test_user', '', 'test_password')
+        article = Article.objects.create(title='Test article', slug='test-article', article_body='Body')
+        queue = comment_queue.CommentQueue(batch_size=3, interval=0.01)
+        queue.start()
+        self.addCleanup(queue.stop)
+
+        for i in range(10):
+            queue.put(user, article, 'Comment {}'.format(i))
+        queue.join()
+
+        self.assertEqual(Comment.objects.count(), 10)
+        article.refresh_from_db()
+        self.assertEqual(article.comment_count, 10)
+
+    def test_spools_of_finished_processes_are_taken_over(self):
+        user = User.objects.create_user('test_user', '', 'test_password')
+        article = Article.objects.create(title='Test article', slug='test-article', article_body='Body')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        spool = os.path.join(directory, 'comments.spool')
+        finished = subprocess.Popen([sys.executable, '-c', ''])
+        finished.wait()
+        for pid, body in [(finished.pid, 'Orphaned comment'), (os.getppid(), 'Running comment')]:
+            with open('{}.{}'.format(spool, pid), 'w') as f:
+                f.write(json.dumps({'id': body, 'author_id': user.pk,
+                                    'article_id': article.pk, 'body': body}) + '\n')
+
+        queue = comment_queue.CommentQueue(spool=spool)
+        queue.start()
+        self.addCleanup(queue.stop)
+        queue.join()
+
+        self.assertEqual(list(Comment.objects.values_list('body', flat=True)), ['Orphaned comment'])
+        self.assertFalse(os.path.exists('{}.{}'.format(spool, finished.pid)))
+        self.assertTrue(os.path.exists('{}.{}'.format(spool, os.getppid())))
+        self.assertEqual(queue._read_spool(), [])
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache',
+                   AUTHENTICATION_BACKENDS=['blog_app.auth.CachedModelBackend'],
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedAuthTest(CustomTestCase):
+
+    def setUp(self):
+        forget_user()
+        self.addCleanup(forget_user)
+        self.user = self.get_new_user(username='test_user1', password='test_password123')
+        article = self.get_new_article(title='Test article', article_body='Test body')
+        article.save()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        return len(context.captured_queries)
+
+    def test_authenticated_requests_make_no_auth_queries(self):
+        anonymous = self.count_queries('/')
+        self.client.login(username='test_user1', password='test_password123')
+        self.client.get('/')
+        self.assertEqual(self.count_queries('/'), anonymous)
+
+    def test_password_change_ends_cached_sessions(self):
+        self.client.login(username='test_user1', password='test_password123')
+        self.assertContains(self.client.get('/'), 'Logged in as test_user1')
+
+        self.user.set_password('new_password123')
+        self.user.save()
+        self.assertNotContains(self.client.get('/'), 'Logged in as test_user1')
+
+    def test_permission_changes_reach_cached_user(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(backend.get_user(self.user.pk).has_perm('blog_app.add_article'))
+
+        self.user.user_permissions.add(Permission.objects.get(codename='add_article'))
+        self.assertTrue(backend.get_user(self.user.pk).has_perm('blog_app.add_article'))
+
+    def test_least_recently_used_users_are_evicted(self):
+        other = self.get_new_user(username='test_user2', password='test_password123')
+        third = self.get_new_user(username='test_user3', password='test_password123')
+        backend = CachedModelBackend()
+        with mock.patch('blog_app.auth.MAX_USERS', 2):
+            backend.get_user(self.user.pk)
+            backend.get_user(other.pk)
+            backend.get_user(self.user.pk)
+            backend.get_user(third.pk)
+            with self.assertNumQueries(0):
+                backend.get_user(self.user.pk)
+                backend.get_user(third.pk)
+            with self.assertNumQueries(3):
+                # the user and its permissions are loaded again
+                backend.get_user(other.pk)
+
+
 class PageNotFoundTest(CustomTestCase):
     
     def test_404_page_renders_correct_template(self):
@@ -193,6 +1209,34 @@ class ArticleTest(CustomTestCase):
                                                    slug=self.article.slug))
         self.assertIn(self.comment, res.context['comments'])
 
+    def test_article_page_paginates_comments(self):
+        comments = [self.comment] + [self.get_new_comment(author=self.user,
+                                                          article_commented=self.article,
+                                                          body='test{}'.format(i))
+                                     for i in range(25)]
+        url = self.base_url.format(hash_=self.article.article_id, slug=self.article.slug)
+
+        res = self.client.get(url)
+        first_page = res.context['comments']
+        self.assertEqual(list(first_page), comments[::-1][:20])
+
+        res = self.client.get(url, {'after': first_page.next_cursor})
+        self.assertEqual(list(res.context['comments']), comments[::-1][20:])
+
+        res = self.client.get(url, {'order': 'oldest'})
+        self.assertEqual(list(res.context['comments']), comments[:20])
+
+    def test_article_page_query_count_does_not_depend_on_comments(self):
+        users = [self.get_new_user(username='commenter{}'.format(i), password='test_password123')
+                 for i in range(5)]
+        for i in range(30):
+            self.get_new_comment(author=users[i % 5], article_commented=self.article, body='test')
+
+        with self.assertMaxQueries(4):
+            res = self.client.get(self.base_url.format(hash_=self.article.article_id,
+                                                       slug=self.article.slug))
+        self.assertContains(res, 'commenter4')
+
 
 class SignupTest(CustomTestCase):
     
@@ -215,6 +1259,72 @@ class LoginTest(CustomTestCase):
         self.assertRedirects(res1, '/')
 
 
+@override_settings(BLOG_THROTTLE=True,
+                   BLOG_THROTTLE_RATES={'login_username': (2, 60), 'signup_ip': (1, 3600)},
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ThrottlingTest(CustomTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        reset_buckets()
+        self.addCleanup(reset_buckets)
+
+    def login(self, username):
+        return self.client.post('/login', {'username': username, 'password': 'wrong_password'})
+
+    def test_login_attempts_are_limited_per_username(self):
+        self.assertRedirects(self.login('test_user'), '/')
+        self.assertRedirects(self.login('Test_User '), '/')
+
+        with mock.patch('blog_app.views.UserLoginForm') as form:
+            res = self.login('test_user')
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(res['Retry-After'], '30')
+        # rejected before the password was looked at
+        form.assert_not_called()
+
+        self.assertRedirects(self.login('other_user'), '/')
+
+    def test_signup_attempts_are_limited_per_ip(self):
+        data = {'username': 'new_user1', 'password1': 'test_password123',
+                'password2': 'test_password123'}
+        self.assertEqual(self.client.post('/signup', data).status_code, 200)
+        data['username'] = 'new_user2'
+        res = self.client.post('/signup', data, REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(self.client.post('/signup', data, REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    @override_settings(BLOG_THROTTLE_RATES={'login_ip': (1, 60), 'login_username': (2, 60)})
+    def test_refused_attempts_do_not_lock_the_account_out(self):
+        self.assertRedirects(self.login('test_user'), '/')
+        for _ in range(3):
+            self.assertEqual(self.login('test_user').status_code, 429)
+        res = self.client.post('/login', {'username': 'test_user', 'password': 'wrong_password'},
+                               REMOTE_ADDR='10.0.0.1')
+        self.assertRedirects(res, '/')
+
+    def test_least_recently_used_buckets_are_evicted(self):
+        self.login('test_user')
+        self.login('test_user')
+        with mock.patch('blog_app.throttling.MAX_BUCKETS', 3):
+            # the IP bucket is used by every attempt and stays
+            self.assertRedirects(self.login('other_user'), '/')
+            self.assertRedirects(self.login('third_user'), '/')
+            self.assertRedirects(self.login('test_user'), '/')
+
+    @override_settings(BLOG_THROTTLE_CACHE_ALIAS='default')
+    def test_buckets_can_be_shared_through_the_cache(self):
+        before = get_throttle_stats()
+        self.login('test_user')
+        self.login('test_user')
+        reset_buckets()
+        self.assertEqual(self.login('test_user').status_code, 429)
+
+        after = get_throttle_stats()
+        self.assertEqual(after.get('login.allowed', 0) - before.get('login.allowed', 0), 2)
+        self.assertEqual(after.get('login.throttled', 0) - before.get('login.throttled', 0), 1)
+
+
 class LogoutTest(CustomTestCase):
     
     def test_logout_url_redirects_to_home_page(self):
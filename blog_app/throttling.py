@@ -0,0 +1,110 @@
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+# (attempts, seconds): a bucket holds `attempts` tokens and refills
+# completely in `seconds`
+DEFAULT_RATES = {
+    'login_ip': (20, 60),
+    'login_username': (5, 60),
+    'signup_ip': (5, 3600),
+    'signup_username': (3, 3600),
+}
+# in-process buckets kept, the least recently used ones go first
+MAX_BUCKETS = 10000
+
+throttle_stats = Counter()
+_buckets = OrderedDict()
+_lock = threading.Lock()
+
+
+def throttling_enabled():
+    return getattr(settings, 'BLOG_THROTTLE', False)
+
+
+def get_rates():
+    rates = dict(DEFAULT_RATES)
+    rates.update(getattr(settings, 'BLOG_THROTTLE_RATES', {}))
+    return rates
+
+
+def get_throttle_stats():
+    return dict(throttle_stats)
+
+
+def reset_buckets():
+    with _lock:
+        _buckets.clear()
+
+
+def _refill(state, attempts, seconds, now):
+    tokens, updated = state if state is not None else (attempts, now)
+    return min(attempts, tokens + (now - updated) * attempts / seconds)
+
+
+def take_token(rate, value):
+    """
+    Take a token from the bucket of `value` (an IP address or a username)
+    under the limit `rate`. Return 0 when there was one, otherwise the
+    seconds until the next token.
+
+    Buckets live in this process unless BLOG_THROTTLE_CACHE_ALIAS names a
+    cache shared by all processes; concurrent requests may then both take
+    the last token, which is close enough for a rate limit.
+    """
+    rates = get_rates()
+    if rates.get(rate) is None:
+        return 0
+    attempts, seconds = rates[rate]
+    key = 'blog_app.throttle.{}.{}'.format(rate, md5(value.encode('utf-8')).hexdigest())
+    now = time.time()
+    alias = getattr(settings, 'BLOG_THROTTLE_CACHE_ALIAS', None)
+
+    def take(state):
+        tokens = _refill(state, attempts, seconds, now)
+        if tokens >= 1:
+            return (tokens - 1, now), 0
+        return (tokens, now), (1 - tokens) * seconds / attempts
+
+    if alias is not None:
+        cache = caches[alias]
+        state, wait = take(cache.get(key))
+        cache.set(key, state, math.ceil(seconds))
+        return wait
+
+    with _lock:
+        state, wait = take(_buckets.pop(key, None))
+        _buckets[key] = state
+        if len(_buckets) > MAX_BUCKETS:
+            # an evicted bucket starts full again, like after a restart
+            _buckets.popitem(last=False)
+    return wait
+
+
+def throttle(request, scope, username):
+    """
+    Spend one attempt of `scope` ('login' or 'signup') for the client IP and,
+    when the IP is within its limit, for the username. Return the seconds the client has to wait, 0 when the
+    attempt may go ahead. Called before the password is hashed.
+    """
+    if not throttling_enabled():
+        return 0
+    wait = take_token(scope + '_ip', request.META.get('REMOTE_ADDR', ''))
+    if not wait:
+        # refused attempts must not drain the bucket of the targeted account
+        wait = take_token(scope + '_username', username.strip().lower())
+    throttle_stats['{}.{}'.format(scope, 'throttled' if wait else 'allowed')] += 1
+    return wait
+
+
+def throttled_response(wait):
+    response = HttpResponse('Too many attempts, try again later.\n',
+                            content_type='text/plain', status=429)
+    response['Retry-After'] = max(math.ceil(wait), 1)
+    return response
@@ -1,15 +1,31 @@
 from django.conf.urls import url
 
-from . import views
+from . import api, views
 
 urlpatterns = [
+    url(r'^api/articles$', api.ApiHomepageView.as_view(), name='api_articles'),
+    url(r'^api/articles/(?P<article_id>[A-Za-z0-9]{6})$', api.ApiArticleView.as_view(), name='api_article'),
+    url(r'^api/categories$', api.ApiCategoryListView.as_view(), name='api_categories'),
+    url(r'^api/category/(?P<category_name>[A-Za-z_ \-0-9+]+)$', api.ApiCategoryView.as_view(), name='api_category'),
+    url(r'^api/(?P<year>[0-9]{4})/(?P<month>[0-9]{2})/(?P<day>[0-9]{2})$', api.ApiDayView.as_view(), name='api_by_day'),
+    url(r'^api/(?P<year>[0-9]{4})/(?P<month>[0-9]{2})$', api.ApiMonthView.as_view(), name='api_by_month'),
+    url(r'^api/(?P<year>[0-9]{4})$', api.ApiYearView.as_view(), name='api_by_year'),
+    url(r'^api/export/articles\.ndjson$', api.ApiExportView.as_view(), name='api_export'),
     url(r'^(?P<year>[0-9]{4})/(?P<month>[0-9]{2})/(?P<day>[0-9]{2})/?$', views.SearchByDayView.as_view(), name='by_day'),
     url(r'^(?P<year>[0-9]{4})/(?P<month>[0-9]{2})/?$', views.SearchByMonthView.as_view(), name='by_month'),
     url(r'^(?P<year>[0-9]{4})/?$', views.SearchByYearView.as_view(), name='by_year'),
+    url(r'^search/?$', views.SearchView.as_view(), name='search'),
+    url(r'^feeds/(?P<feed_type>rss|atom)$', views.FeedView.as_view(), name='feed'),
+    url(r'^feeds/category/(?P<category_name>[A-Za-z_ \-0-9+]+)/(?P<feed_type>rss|atom)$',
+        views.FeedView.as_view(), name='category_feed'),
+    url(r'^sitemap\.xml$', views.SitemapIndexView.as_view(), name='sitemap_index'),
+    url(r'^sitemap-(?P<section>[a-z]+)-(?P<page>[0-9]+)\.xml$', views.SitemapView.as_view(), name='sitemap'),
     url(r'^category/(?P<category_name>[A-Za-z_ \-0-9+]+)', views.CategoryView.as_view(), name='category'),
     url(r'^(?P<article_id>[A-Za-z0-9]{6})/(?P<slug>[a-zA-z\-]+)', views.ArticleView.as_view(), name='article'),
     url(r'^signup$', views.SignupView.as_view(), name='signup'),
     url(r'^login$', views.LoginView.as_view(), name='login'),
     url(r'^logout$', views.LogoutView.as_view(), name='logout'),
+    url(r'^widgets$', views.UserWidgetsView.as_view(), name='widgets'),
+    url(r'^metrics$', views.MetricsView.as_view(), name='metrics'),
     url(r'^$', views.HomepageView.as_view(), name='homepage'),
 ]
\ No newline at end of file
@@ -1,25 +1,45 @@
+from datetime import date, timedelta
 from django.views import View
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
 from django.contrib.auth.views import logout
 from django.views.generic import TemplateView
 from django.template.context_processors import csrf
-from django.http import Http404, HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.utils.http import urlencode
+from django.core.urlresolvers import reverse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
-from .models import Article, Category, Comment, User
+from .models import Article, ArchiveDay, Category, Comment, User
 from .forms import UserSignupForm, UserLoginForm, CommentForm
+from .pagination import CountedPaginator, CursorPaginator, InvalidCursor
+from .search import search_articles
+from .cache import (CachedPageMixin, ConditionalGetMixin, article_group, category_group,
+                    archive_group, get_fragment_cache_stats, HOMEPAGE_GROUP,
+                    USER_WIDGETS)
+from .feeds import feed_response
+from .sitemaps import SECTIONS, section_pages, sitemap_index, sitemap_urls
+from .sqlite import retry_on_lock
+from .comment_queue import comment_queue_enabled, get_comment_queue
+from .throttling import get_throttle_stats, throttle, throttled_response
+from .metrics import get_metrics
 
 
 class BaseView(TemplateView):
     login_form = UserLoginForm()
+    per_page = 5
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context.update({'login_form': self.login_form})
         return context
     
-    def get_page_context(self, objects, page):
-        paginator = Paginator(objects, 5)
+    def get_page_context(self, objects, page, count=None):
+        if count is None:
+            paginator = Paginator(objects, self.per_page)
+        else:
+            paginator = CountedPaginator(objects, self.per_page, count)
         try:
             articles = paginator.page(page)
         except PageNotAnInteger:
@@ -28,22 +48,46 @@ class BaseView(TemplateView):
             articles = paginator.page(paginator.num_pages)
         return articles
 
+    def get_articles(self):
+        # every listing starts from this queryset, the JSON API narrows it
+        return Article.objects.for_listing()
+
+    def get_cursor_page_context(self, queryset, ordering=('-created', '-article_id')):
+        paginator = CursorPaginator(queryset, self.per_page, ordering=ordering)
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+        try:
+            articles = paginator.page(after=after, before=before)
+        except InvalidCursor:
+            articles = paginator.page()
+        return articles
+
 
-class HomepageView(BaseView):
+class HomepageView(CachedPageMixin, ConditionalGetMixin, BaseView):
     template_name = "blog_app/homepage.html"
 
+    def get_cache_group(self):
+        return HOMEPAGE_GROUP
+
+    def get_validators(self):
+        return Article.objects.last_modified(), None
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        page = self.request.GET.get('page')
-        all_articles = Article.objects.all()[::-1]
-        articles = self.get_page_context(all_articles, page)
+        articles = self.get_cursor_page_context(self.get_articles())
         context['articles'] = articles
         return context
 
 
-class CategoryView(BaseView):
+class CategoryView(CachedPageMixin, ConditionalGetMixin, BaseView):
     template_name = 'blog_app/category.html'
-        
+
+    def get_cache_group(self):
+        return category_group(self.kwargs['category_name'])
+
+    def get_validators(self):
+        return Article.objects.filter(category__name=self.kwargs['category_name']).last_modified(), None
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         category_name = context['category_name']
@@ -52,62 +96,103 @@ class CategoryView(BaseView):
         except Category.DoesNotExist:
             return context
         else:
-            page = self.request.GET.get('page')
-            filtered_articles = Article.objects.filter(category=category_obj)[::-1]
-            articles = self.get_page_context(filtered_articles, page)
+            filtered_articles = self.get_articles().filter(category=category_obj)
+            articles = self.get_cursor_page_context(filtered_articles)
             context['articles'] = articles
             return context
 
 
-class SearchByBaseView(BaseView):
+class SearchByBaseView(CachedPageMixin, ConditionalGetMixin, BaseView):
     template_name = 'blog_app/by_date.html'
 
+    def get_cache_group(self):
+        return archive_group(self.kwargs['year'], self.kwargs.get('month'), self.kwargs.get('day'))
+
+    def get_validators(self):
+        if not self.get_archive_count():
+            return None, 0
+        start, end = self.get_date_range()
+        return Article.objects.modified_between(start, end).last_modified(), self.get_archive_count()
+
+    def get_date_range(self):
+        raise NotImplementedError('Date views must define their date range')
+
+    def get_archive_count(self):
+        # the archive table answers empty dates without scanning articles
+        if not hasattr(self, '_archive_count'):
+            try:
+                start, end = self.get_date_range()
+            except ValueError:
+                # e.g. /2017/02/30
+                self._archive_count = 0
+            else:
+                self._archive_count = ArchiveDay.objects.count_between(start, end)
+        return self._archive_count
+
+    def get_searched_date(self):
+        raise NotImplementedError('Date views must define their date label')
 
-class SearchByYearView(SearchByBaseView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        year = context['year']
         page = self.request.GET.get('page')
-        filtered_articles = Article.objects.filter(last_modified__year=year)
-        articles = self.get_page_context(filtered_articles, page)
+        filtered_articles = []
+        if self.get_archive_count():
+            start, end = self.get_date_range()
+            filtered_articles = self.get_articles().modified_between(start, end)
+        # the archive table already counted the articles of these dates
+        articles = self.get_page_context(filtered_articles, page, count=self.get_archive_count())
         context.update(
-            {'searched_date': "{year}".format(year=year),
+            {'searched_date': self.get_searched_date(),
              'articles': articles})
         return context
 
 
+class SearchByYearView(SearchByBaseView):
+    def get_date_range(self):
+        year = int(self.kwargs['year'])
+        return date(year, 1, 1), date(year + 1, 1, 1)
+
+    def get_searched_date(self):
+        return "{year}".format(**self.kwargs)
+
+
 class SearchByMonthView(SearchByBaseView):
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        
-        year = context['year']
-        month = context['month']
-        page = self.request.GET.get('page')
-        filtered_articles = Article.objects.filter(last_modified__year=year,
-                                                   last_modified__month=month)
-        articles = self.get_page_context(filtered_articles, page)
-        context.update(
-            {'searched_date': "{year}/{month}".format(year=year, month=month),
-             'articles': articles})
-        return context 
+    def get_date_range(self):
+        year = int(self.kwargs['year'])
+        month = int(self.kwargs['month'])
+        start = date(year, month, 1)
+        if month == 12:
+            return start, date(year + 1, 1, 1)
+        return start, date(year, month + 1, 1)
+
+    def get_searched_date(self):
+        return "{year}/{month}".format(**self.kwargs)
 
 
 class SearchByDayView(SearchByBaseView):
+    def get_date_range(self):
+        start = date(int(self.kwargs['year']), int(self.kwargs['month']), int(self.kwargs['day']))
+        return start, start + timedelta(days=1)
+
+    def get_searched_date(self):
+        return "{year}/{month}/{day}".format(**self.kwargs)
+
+
+class SearchView(BaseView):
+    template_name = 'blog_app/search.html'
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        
-        year = context['year']
-        month = context['month']
-        day = context['day']
-        page = self.request.GET.get('page')
-        filtered_articles = Article.objects.filter(last_modified__year=year,
-                                                   last_modified__month=month,
-                                                   last_modified__day=day)
-        articles = self.get_page_context(filtered_articles, page)
+        query = self.request.GET.get('q', '').strip()
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+        try:
+            articles = search_articles(query, self.per_page, after=after, before=before)
+        except InvalidCursor:
+            articles = search_articles(query, self.per_page)
         context.update(
-            {'searched_date': "{year}/{month}/{day}".format(year=year,
-                                                            month=month,
-                                                            day=day),
+            {'query': query,
+             'pagination_query': urlencode({'q': query}) + '&',
              'articles': articles})
         return context
 
@@ -120,30 +205,66 @@ class PageNotFoundView(BaseView):
         return context
 
 
-class ArticleView(View):
+class ArticleView(CachedPageMixin, ConditionalGetMixin, View):
     template_name = 'blog_app/article.html'
     login_form = UserLoginForm()
     comment_form = CommentForm()
 
+    cache_page_params = ('after', 'before', 'order')
+    comments_per_page = 20
+    comment_orderings = {'newest': ('-date', '-id'),
+                         'oldest': ('date', 'id')}
+
+    def get_cache_group(self):
+        return article_group(self.kwargs['article_id'])
+
+    def get_validators(self):
+        article = (Article.objects.filter(article_id=self.kwargs['article_id'])
+                                  .values('last_modified', 'last_comment', 'comment_count')
+                                  .first())
+        if article is None:
+            return None, 0
+        last_modified = max(filter(None, (article['last_modified'], article['last_comment'])))
+        return last_modified, article['comment_count']
+
+    def get_comments_order(self):
+        order = self.request.GET.get('order')
+        if order not in self.comment_orderings:
+            order = 'newest'
+        return order
+
     def get_article_comments(self, article_id):
-        comments = Comment.objects.filter(article_commented__article_id=article_id)
-        return comments
+        comments = (Comment.objects.filter(article_commented_id=article_id)
+                                   .select_related('author'))
+        paginator = CursorPaginator(comments, self.comments_per_page,
+                                    ordering=self.comment_orderings[self.get_comments_order()])
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+        try:
+            return paginator.page(after=after, before=before)
+        except InvalidCursor:
+            return paginator.page()
 
-    def get(self, request, *args, **kwargs):
-        article_id = kwargs['article_id']
+    def get_article(self, article_id):
         try:
-            article_obj = Article.objects.get(article_id=article_id)
+            return Article.objects.get(article_id=article_id)
         except Article.DoesNotExist:
-            raise 404
+            raise Http404
+
+    def get(self, request, *args, **kwargs):
+        article_id = kwargs['article_id']
+        article_obj = self.get_article(article_id)
 
         comment_form = CommentForm()
         comments = self.get_article_comments(article_id)
         
-        context = {'title': article_obj.title,
+        context = {'article': article_obj,
+                   'title': article_obj.title,
                    'last_modified': article_obj.last_modified,
                    'categories': article_obj.category.all(),
                    'article_body': article_obj.article_body,
                    'comments': comments,
+                   'comments_order': self.get_comments_order(),
                    'login_form': self.login_form,
                    'comment_form': self.comment_form}
         return render(request, self.template_name, context)
@@ -154,11 +275,90 @@ class ArticleView(View):
         author = request.user
         article = Article.objects.get(article_id=kwargs['article_id'])
         
-        if comment_form.is_valid():
-            comment_form.save(author, article)
+        if comment_form.is_valid() and author.is_authenticated:
+            if comment_queue_enabled():
+                get_comment_queue().put(author, article, comment_form.cleaned_data['body'])
+            else:
+                retry_on_lock(lambda: comment_form.save(author, article))
         return HttpResponseRedirect(request.get_full_path())
 
 
+class FeedView(ConditionalGetMixin, View):
+    items = 20
+
+    def get_category(self):
+        name = self.kwargs.get('category_name')
+        if name is None:
+            return None
+        try:
+            return Category.objects.get(name=name)
+        except Category.DoesNotExist:
+            raise Http404
+
+    def get_articles(self):
+        articles = Article.objects.all()
+        if self.kwargs.get('category_name') is not None:
+            articles = articles.filter(category__name=self.kwargs['category_name'])
+        return articles
+
+    def get_cache_group(self):
+        name = self.kwargs.get('category_name')
+        return HOMEPAGE_GROUP if name is None else category_group(name)
+
+    def get_validators(self):
+        # also gives the feed its updated date
+        if not hasattr(self, '_validators'):
+            self._validators = self.get_articles().last_modified(), None
+        return self._validators
+
+    def get(self, request, *args, **kwargs):
+        category = self.get_category()
+        group = self.get_cache_group()
+        if category is None:
+            title, link = 'Latest articles', reverse('homepage')
+        else:
+            title = 'Latest articles in {}'.format(category.name)
+            link = category.get_absolute_url()
+        articles = (self.get_articles().for_listing()
+                                       .order_by('-created', '-article_id')[:self.items])
+        updated, count = self.get_validators()
+        return feed_response(request, kwargs['feed_type'], group, title, link, articles, updated)
+
+
+class SitemapIndexView(View):
+
+    def get(self, request, *args, **kwargs):
+        base_url = request.build_absolute_uri('/').rstrip('/')
+        return StreamingHttpResponse(sitemap_index(base_url), content_type='application/xml')
+
+
+class SitemapView(View):
+
+    def get(self, request, *args, **kwargs):
+        section = kwargs['section']
+        page = int(kwargs['page'])
+        if section not in SECTIONS or not 1 <= page <= section_pages(section):
+            raise Http404
+        base_url = request.build_absolute_uri('/').rstrip('/')
+        return StreamingHttpResponse(sitemap_urls(base_url, section, page),
+                                     content_type='application/xml')
+
+
+class UserWidgetsView(View):
+    """
+    The per-user parts of a page as HTML snippets keyed by widget name,
+    fetched by widgets.js when BLOG_DEFERRED_WIDGETS keeps them out of the
+    cached pages.
+    """
+
+    def get(self, request, *args, **kwargs):
+        context = {'login_form': UserLoginForm(), 'comment_form': CommentForm()}
+        response = JsonResponse({name: render_to_string(template, context, request=request)
+                                 for name, template in USER_WIDGETS.items()})
+        patch_cache_control(response, private=True, no_cache=True, no_store=True)
+        return response
+
+
 class SignupView(View):
     template_name = 'blog_app/signup.html'
 
@@ -169,11 +369,14 @@ class SignupView(View):
         return render(request, self.template_name, arguments)
 
     def post(self, request, *args, **kwargs):
+        wait = throttle(request, 'signup', request.POST.get('username', ''))
+        if wait:
+            return throttled_response(wait)
         form = UserSignupForm(request.POST)
         username = request.POST['username']
 
         if form.is_valid():
-            form.save()
+            retry_on_lock(form.save)
             return render(request, self.template_name)
         else:
             return render(request, self.template_name, {'errors': form.error_messages,
@@ -186,6 +389,9 @@ class LoginView(View):
         return HttpResponseRedirect('/')
 
     def post(self, request, *args, **kwargs):
+        wait = throttle(request, 'login', request.POST.get('username', ''))
+        if wait:
+            return throttled_response(wait)
         form = UserLoginForm(request, data=request.POST)
         if form.is_valid():
             form.login()
@@ -199,4 +405,14 @@ class LogoutView(View):
         return HttpResponseRedirect('/')
 
     def post(self, request, *args, **kwargs):
-        return HttpResponseRedirect('/')
\ No newline at end of file
+        return HttpResponseRedirect('/')
+
+
+class MetricsView(View):
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_staff:
+            raise Http404
+        return JsonResponse({'routes': get_metrics(),
+                             'fragment_cache': get_fragment_cache_stats(),
+                             'throttling': get_throttle_stats()})